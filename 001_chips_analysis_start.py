@@ -4,74 +4,95 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from qvi_schema import write_table, artifact_path
+from qvi_rules import evaluate
+from chips_clean import tx_rules, rule_report, clean_customers, print_report, stream_clean_transactions
+from qvi_instrument import stage
 
-# --- load ---
-tx = pd.read_csv('transactions.csv', parse_dates=['transaction_date'], dayfirst=False)  # adjust parse if needed
-cust = pd.read_csv('customers.csv', parse_dates=['signup_date'], dayfirst=False)
+STREAMING = False     # True: bounded-memory chunked pass over transactions.csv (see chips_clean.py)
+CHUNKSIZE = 500_000   # rows per chunk in streaming mode
+RULE_ACTIONS = {}     # override rule actions ('flag'/'drop'/'quarantine'), e.g. {'non_positive:price': 'quarantine'}
 
-# --- basic inspections ---
-print(tx.shape, cust.shape)
-print(tx.head())
-print(tx.dtypes)
+# each step below appends a timing/memory/row-flow record to .cache/stages.jsonl (see qvi_instrument.py)
+with stage('load_customers') as st:
+    cust = pd.read_csv('customers.csv', parse_dates=['signup_date'], dayfirst=False)
+    st.rows_out = len(cust)
 
-# --- common sanity checks on transaction data ---
-# 1. Missing critical fields
-required_tx = ['transaction_id','customer_id','sku','quantity','price','transaction_date','store_id','category','subcategory']
-for c in required_tx:
-    if c not in tx.columns:
-        print(f'WARNING: {c} missing from transactions')
+if STREAMING:
+    # --- customers checks --- (the customer table is small and stays in memory)
+    print('cust nulls:\n', cust.isnull().sum())
+    with stage('clean_customers', rows_in=len(cust)) as st:
+        cust = clean_customers(cust)
+        st.rows_out = len(cust)
+        st.drop('duplicate_customer', st.rows_in - st.rows_out)
 
-# 2. Nulls & duplicates
-print('tx nulls:\n', tx[required_tx].isnull().sum())
-tx = tx.drop_duplicates(subset=['transaction_id','sku'])  # adjust if transaction lines repeated
+    # --- transactions: checks, dedup, merge and save, one chunk at a time ---
+    # (appended as CSV; artifact_path removes Parquet copies of an earlier in-memory run so read_table picks the CSV)
+    with stage('stream_clean_transactions', chunksize=CHUNKSIZE) as st:
+        report = stream_clean_transactions('transactions.csv', cust, artifact_path('transactions_clean', '.csv'),
+                                           artifact_path('tx_cust_merged', '.csv'), chunksize=CHUNKSIZE,
+                                           actions=RULE_ACTIONS, quarantine_out=artifact_path('transactions_quarantine', '.csv'))
+        st.rows_in, st.rows_out = report['tx_rows'], report['clean_rows']
+        for rule, n in report['removed'].items():
+            st.drop(rule, n)
+        st.note(chips_rows=report['chips_rows'], null_customer=report['merged_null_customer'], outliers=report['outliers'])
+    cust.to_csv(artifact_path('customers_clean', '.csv'), index=False)
+    print_report(report)
+    print('Saved cleaned files.')
 
-# 3. Numeric checks
-tx['quantity'] = pd.to_numeric(tx['quantity'], errors='coerce')
-tx['price'] = pd.to_numeric(tx['price'], errors='coerce')
+else:
+    # --- load ---
+    with stage('load_transactions') as st:
+        tx = pd.read_csv('transactions.csv', parse_dates=['transaction_date'], dayfirst=False)  # adjust parse if needed
+        st.rows_out = len(tx)
+    report = {'tx_shape': tx.shape}
 
-# Remove or flag negative/zero prices or quantities
-bad_qty = tx[tx['quantity'] <= 0]
-bad_price = tx[tx['price'] <= 0]
-print('bad_qty rows:', len(bad_qty))
-print('bad_price rows:', len(bad_price))
+    # --- basic inspections ---
+    print(tx.shape, cust.shape)
+    print(tx.head())
+    print(tx.dtypes)
 
-# Strategy: remove rows with zero/negative quantity or price, unless flagged for manual review
-tx = tx[(tx['quantity'] > 0) & (tx['price'] > 0)]
+    # --- common sanity checks on transaction data ---
+    # All checks are rules (chips_clean.tx_rules) evaluated in one vectorized pass into a
+    # per-row bitmask (see qvi_rules.py); no intermediate frames are sliced out to count them:
+    # 1. Missing critical fields  2. Nulls & duplicates on (transaction_id, sku)
+    # 3. Numeric coercion and zero/negative quantity or price (removed, or quarantined via RULE_ACTIONS)
+    # 5. Category identification for chips (adjust condition in chips_clean.chips_rule)
+    # 6. Outliers: quantity or price above OUTLIER_MULTIPLE x the 99th percentile of the kept rows (flagged)
+    with stage('validate', rows_in=len(tx)) as st:
+        res = evaluate(tx, tx_rules(), actions=RULE_ACTIONS)
+        report.update(rule_report(res))
+        tx, quarantine = res.split(tx)
+        for rule, n in res.removed().items():
+            st.drop(rule, n)
+        st.rows_out = len(tx)
+        st.note(chips_rows=report['chips_rows'], outliers=report['outliers'], quarantined=len(quarantine))
 
-# 4. Create total line value
-tx['line_total'] = tx['quantity'] * tx['price']
+    # 4. Create total line value
+    tx['line_total'] = tx['quantity'] * tx['price']
+    tx['is_chips'] = ~res.failed('not_chips')[res.keep]
 
-# 5. Category identification for chips (adjust condition to your schema)
-chips_mask = (
-    tx['category'].str.lower().fillna('') == 'chips'
-) | (
-    tx['subcategory'].str.lower().fillna('').str.contains('chip|crisps')
-)
-tx['is_chips'] = chips_mask
+    # --- customers checks ---
+    print('cust nulls:\n', cust.isnull().sum())
+    # Normalize key attributes, remove duplicates on customer_id
+    with stage('clean_customers', rows_in=len(cust)) as st:
+        cust = clean_customers(cust)
+        st.rows_out = len(cust)
+        st.drop('duplicate_customer', st.rows_in - st.rows_out)
 
-# 6. Outliers: extremely large quantity or price
-qty_q99 = tx['quantity'].quantile(0.99)
-price_q99 = tx['price'].quantile(0.99)
-print('99th pct quantity, price:', qty_q99, price_q99)
-# flag extreme rows
-outliers = tx[(tx['quantity'] > qty_q99 * 5) | (tx['price'] > price_q99 * 5)]
-print('Potential extreme outliers:', len(outliers))
+    # --- merge ---
+    with stage('merge_customers', rows_in=len(tx)) as st:
+        merged = tx.merge(cust, how='left', on='customer_id', suffixes=('','_cust'))
+        report['merged_null_customer'] = int(merged['customer_id'].isnull().sum())
+        st.rows_out = len(merged)
+        st.note(null_customer=report['merged_null_customer'])
 
-# --- customers checks ---
-print('cust nulls:\n', cust.isnull().sum())
-# Normalize key attributes
-if 'postal_code' in cust.columns:
-    cust['postal_code'] = cust['postal_code'].astype(str).str.strip()
-
-# Remove duplicates on customer_id
-cust = cust.drop_duplicates(subset=['customer_id'])
-
-# --- merge ---
-merged = tx.merge(cust, how='left', on='customer_id', suffixes=('','_cust'))
-print('merged null customer count:', merged['customer_id'].isnull().sum())
-
-# Save cleaned files
-tx.to_csv('transactions_clean.csv', index=False)
-cust.to_csv('customers_clean.csv', index=False)
-merged.to_csv('tx_cust_merged.csv', index=False)
-print('Saved cleaned files.')
+    # Save cleaned files (typed Parquet, see qvi_schema.py)
+    with stage('write_tables', rows_in=len(merged)):
+        write_table(tx, 'transactions_clean')
+        write_table(cust, 'customers_clean')
+        write_table(merged, 'tx_cust_merged')
+        if len(quarantine):
+            write_table(quarantine, 'transactions_quarantine')   # rows of 'quarantine' rules, with failed_rules
+    print_report(report)
+    print('Saved cleaned files.')
@@ -1,51 +1,54 @@
 # Exploratory analysis & charts (code snippets)
 
-import matplotlib.pyplot as plt
-
-merged = pd.read_csv('tx_cust_merged.csv', parse_dates=['transaction_date'])
-
-# Filter chips rows
-chips = merged[merged['is_chips'] == True].copy()
-
-# 1. Time series: daily sales for chips
-daily = chips.groupby(chips['transaction_date'].dt.date)['line_total'].sum().reset_index()
-daily['transaction_date'] = pd.to_datetime(daily['transaction_date'])
-plt.figure(figsize=(10,4))
-plt.plot(daily['transaction_date'], daily['line_total'])
-plt.title('Daily Chips Sales')
-plt.ylabel('Sales')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('fig_daily_chips_sales.png')
-
-# 2. Sales by store (top 10)
-store_sales = chips.groupby('store_id')['line_total'].sum().sort_values(ascending=False).head(10)
-store_sales.plot(kind='bar', figsize=(10,5))
-plt.title('Top 10 Stores by Chips Sales')
-plt.tight_layout()
-plt.savefig('fig_top10_stores.png')
-
-# 3. Packet size distribution (if column exists: 'packet_size')
-if 'packet_size' in chips.columns:
-    pkt = chips.groupby('packet_size').agg({'line_total':'sum','quantity':'sum'}).sort_values('quantity', ascending=False)
-    pkt.to_csv('chips_sales_by_packet_size.csv')
-    pkt['quantity'].plot(kind='bar', figsize=(8,4))
-    plt.title('Units Sold by Packet Size')
-    plt.tight_layout()
-    plt.savefig('fig_packet_size_units.png')
-
-# 4. SKU Pareto (top SKUs)
-sku = chips.groupby('sku').agg({'quantity':'sum','line_total':'sum'}).sort_values('quantity', ascending=False).head(20)
-sku['quantity'].plot(kind='bar', figsize=(10,5))
-plt.title('Top 20 SKUs by Units Sold')
-plt.tight_layout()
-plt.savefig('fig_top_skus.png')
-
-# 5. Basket analysis: distribution of chips-containing basket value
-baskets = chips.groupby('transaction_id').agg({'line_total':'sum','quantity':'sum'}).reset_index()
-plt.figure(figsize=(8,4))
-plt.hist(baskets['line_total'], bins=50)
-plt.title('Distribution of Chips Basket Value')
-plt.xlabel('Chips Basket Value')
-plt.tight_layout()
-plt.savefig('fig_chips_basket_dist.png')
+from chips_cube import SalesCube, LINE_COLUMNS
+from qvi_charts import ChartSpec, render_all
+from qvi_schema import read_table
+
+VERIFY_CUBE = False   # True: check the cube roll-ups against direct groupbys of the chips rows
+
+# Figures are collected as ChartSpecs of the small rolled-up series and rendered at the end
+# (Agg OO API, worker pool, unchanged figures skipped; see qvi_charts.py). Everything runs
+# under __main__, so spawn/forkserver render workers re-importing this script do no work.
+def build_specs():
+    # chips sales cube of tx_cust_merged (store x day x sku cells, see chips_cube.py);
+    # built from the chips rows once per version of the table, every chart below is a roll-up
+    cube = SalesCube.for_table('tx_cust_merged', date_col='transaction_date')
+    if VERIFY_CUBE:
+        lines = read_table('tx_cust_merged', columns=['transaction_date', 'is_chips'] + LINE_COLUMNS)
+        cube.verify(lines[lines['is_chips']], date_col='transaction_date')
+
+    specs = []
+
+    # 1. Time series: daily sales for chips
+    daily = cube.rollup(['date'], ['line_total']).rename(columns={'date': 'transaction_date'})
+    specs.append(ChartSpec('fig_daily_chips_sales.png', 'line',
+                           {'series': [(None, daily['transaction_date'].to_numpy(), daily['line_total'].to_numpy())]},
+                           {'figsize': (10,4), 'title': 'Daily Chips Sales', 'ylabel': 'Sales', 'xrot': 45, 'tight': True}))
+
+    # 2. Sales by store (top 10)
+    store_sales = cube.rollup(['store_id'], ['line_total']).set_index('store_id')['line_total'].sort_values(ascending=False).head(10)
+    specs.append(ChartSpec('fig_top10_stores.png', 'bar', {'labels': store_sales.index.to_numpy(), 'values': store_sales.to_numpy()},
+                           {'figsize': (10,5), 'title': 'Top 10 Stores by Chips Sales', 'xlabel': 'store_id', 'xrot': 90, 'tight': True}))
+
+    # 3. Packet size distribution (if column exists: 'packet_size')
+    if 'packet_size' in cube.attributes:
+        pkt = cube.rollup(['packet_size'], ['line_total','quantity']).set_index('packet_size').sort_values('quantity', ascending=False)
+        pkt.to_csv('chips_sales_by_packet_size.csv')
+        specs.append(ChartSpec('fig_packet_size_units.png', 'bar', {'labels': pkt.index.to_numpy(), 'values': pkt['quantity'].to_numpy()},
+                               {'figsize': (8,4), 'title': 'Units Sold by Packet Size', 'xlabel': 'packet_size', 'xrot': 90, 'tight': True}))
+
+    # 4. SKU Pareto (top SKUs)
+    sku = cube.rollup(['sku'], ['quantity','line_total']).set_index('sku').sort_values('quantity', ascending=False).head(20)
+    specs.append(ChartSpec('fig_top_skus.png', 'bar', {'labels': sku.index.to_numpy(), 'values': sku['quantity'].to_numpy()},
+                           {'figsize': (10,5), 'title': 'Top 20 SKUs by Units Sold', 'xlabel': 'sku', 'xrot': 90, 'tight': True}))
+
+    # 5. Basket analysis: distribution of chips-containing basket value
+    baskets = cube.baskets.groupby('transaction_id').agg({'line_total':'sum','quantity':'sum'}).reset_index()
+    specs.append(ChartSpec('fig_chips_basket_dist.png', 'hist', {'values': baskets['line_total'].to_numpy()},
+                           {'figsize': (8,4), 'bins': 50, 'title': 'Distribution of Chips Basket Value', 'xlabel': 'Chips Basket Value', 'tight': True}))
+    return specs
+
+
+if __name__ == '__main__':
+    rendered, skipped = render_all(build_specs())
+    print(f'Rendered {len(rendered)} figure(s), {len(skipped)} unchanged.')
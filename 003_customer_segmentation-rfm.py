@@ -3,13 +3,23 @@
 ## 2 ## Standardize and create RFM score (1-5 each), then combine (e.g., R*100 + F*10 + M).
 ## 3 ## Identify segments: Champion, Loyal, Potential, At-risk, Lost.
 
+import pandas as pd
 import numpy as np
-snapshot_date = chips['transaction_date'].max() + pd.Timedelta(days=1)
-rfm = chips.groupby('customer_id').agg({
-    'transaction_date': lambda x: (snapshot_date - x.max()).days,
-    'transaction_id': 'nunique',
-    'line_total': 'sum'
-}).rename(columns={'transaction_date':'recency','transaction_id':'frequency','line_total':'monetary'})
+from chips_rfm import rfm_state
+from qvi_schema import read_table
+
+# chips lines of the merged table written by 001
+chips = read_table('tx_cust_merged', columns=['customer_id','transaction_id','transaction_date','quantity','line_total','is_chips'])
+chips = chips[chips['is_chips']]
+
+# vectorized per-customer state (last date, distinct transactions, spend) — see chips_rfm.py
+state, _ = rfm_state(chips, date_col='transaction_date')
+snapshot_date = state['last_date'].max() + pd.Timedelta(days=1)
+rfm = pd.DataFrame({
+    'recency': (snapshot_date - state['last_date']).dt.days,
+    'frequency': state['frequency'],
+    'monetary': state['monetary']
+})
 
 # score
 rfm['r_score'] = pd.qcut(rfm['recency'], 5, labels=[5,4,3,2,1]).astype(int)   # lower recency => higher score
@@ -1,8 +1,24 @@
 # Basket / cross-sell analysis
 ## 1 ## Look at transactions containing chips and compute most common co-purchased categories (e.g., soda, dip, sandwich fillings).
 ## 2 ## Use simple co-occurrence:
+## 3 ## Pairwise rules (support, confidence, lift) at category and SKU level from one sparse incidence matrix per level (chips_basket.py).
 
+from chips_basket import incidence, flagged_baskets, cooccurrence_with, association_rules
+from qvi_schema import read_table
+
+MIN_SUPPORT = 0.001   # fraction of all baskets
+TOP_K = 10            # rules kept per antecedent
+
+# basket lines of the merged table written by 001
+merged = read_table('tx_cust_merged', columns=['transaction_id','category','sku','is_chips'])
 tx_lines = merged[['transaction_id','category','sku','is_chips']]
-chips_txids = tx_lines[tx_lines['is_chips']]['transaction_id'].unique()
-co = merged[merged['transaction_id'].isin(chips_txids)].groupby('category')['transaction_id'].nunique().sort_values(ascending=False)
+
+# category level: chips baskets per category is one view of the co-occurrence counts
+X_cat, txns, categories = incidence(tx_lines, 'category')
+co = cooccurrence_with(X_cat, categories, flagged_baskets(tx_lines, txns))
 co.to_csv('chips_basket_category_cooccurrence.csv')
+association_rules(X_cat, categories, min_support=MIN_SUPPORT, top_k=TOP_K).to_csv('basket_category_rules.csv', index=False)
+
+# SKU level
+X_sku, _, skus = incidence(tx_lines, 'sku')
+association_rules(X_sku, skus, min_support=MIN_SUPPORT, top_k=TOP_K).to_csv('basket_sku_rules.csv', index=False)
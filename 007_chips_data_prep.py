@@ -4,120 +4,133 @@
 
 # chips_data_prep.py
 import pandas as pd
-import numpy as np
-import re
 from pathlib import Path
-from datetime import datetime
-import matplotlib.pyplot as plt
+from qvi_ingest import load_transactions, transactions_parquet
+from qvi_schema import write_table, resolve, read_table
+from chips_cube import SalesCube, cube_dir_for, LINE_COLUMNS
+from qvi_charts import ChartSpec, render_all
+from chips_rfm import RFMStore, rfm_state, rfm_table, score_rfm
+from qvi_products import PRODUCT_LOOKUP, load_product_lookup, update_product_lookup, save_product_lookup, product_attributes
+from qvi_instrument import stage
+from qvi_rules import evaluate
+from chips_clean import qvi_chips_rules
 
 # --- paths (adjust if needed) ---
 TXN_XLSX = Path('QVI_transaction_data.xlsx')
 CUST_CSV = Path('QVI_purchase_behaviour.csv')
 OUT_DIR = Path('.')  # saves outputs to current folder (change if desired)
+CACHE_DIR = Path('.cache')  # parsed transaction cache, keyed by workbook hash
 
-# --- helpers ---
-def excel_serial_to_date(x):
-    try:
-        xi = float(x)
-        return pd.to_datetime('1899-12-30') + pd.to_timedelta(int(xi), unit='D')
-    except:
-        return pd.to_datetime(x, errors='coerce')
-
-def extract_pack_size(desc):
-    if pd.isna(desc):
-        return np.nan
-    s = str(desc).lower()
-    m = re.search(r'(\d+\s?g|\d+\s?kg|\d+\s?ml|\d+\s?l|\d+\s?ct|\d+\s?g\w?)', s)
-    return m.group(0).replace(' ', '') if m else np.nan
-
-def extract_brand(desc):
-    if pd.isna(desc): return np.nan
-    tokens = re.split(r'[\s\-\(\)\,\/]+', str(desc))
-    return tokens[0].title() if tokens else np.nan
-
-# --- load data ---
-xls = pd.ExcelFile(TXN_XLSX)
-# first sheet named 'in' in your file — adjust name if different
-tx = pd.read_excel(xls, sheet_name='in', dtype=object)
+BACKEND = 'pandas'  # 'duckdb': one lazy query over the Parquet cache, filters before the customer merge (chips_lazy.py)
+VERIFY_CUBE = False  # True: check the cube roll-ups against direct groupbys of tx_chips_clean
+VERIFY_RFM = False   # True: fold tx_chips_clean month by month into an RFMStore and check it scores like the batch
+RULE_ACTIONS = {}   # pandas backend: override chips rule actions, e.g. {'non_positive:price': 'quarantine'} (see chips_clean.py)
 
 cust = pd.read_csv(CUST_CSV, low_memory=False)
 
 # --- normalize and convert ---
-tx.columns = [c.strip().lower().replace(' ', '_') for c in tx.columns]
-tx['date'] = tx['date'].apply(excel_serial_to_date) if 'date' in tx.columns else tx.iloc[:,0].apply(excel_serial_to_date)
-tx.rename(columns={
-    'lylty_card_nbr':'customer_id',
-    'prod_qty':'quantity',
-    'tot_sales':'line_total',
-    'txn_id':'transaction_id',
-    'prod_name':'product_description',
-    'prod_nbr':'sku',
-    'store_nbr':'store_id'
-}, inplace=True)
-
 cust.columns = [c.strip().lower().replace(' ', '_') for c in cust.columns]
 cust.rename(columns={'lylty_card_nbr':'customer_id'}, inplace=True)
 
-# numeric conversions
-tx['quantity'] = pd.to_numeric(tx['quantity'], errors='coerce')
-tx['line_total'] = pd.to_numeric(tx['line_total'], errors='coerce')
-tx['price'] = tx['line_total'] / tx['quantity']
-
-# derive brand and pack size
-tx['pack_size'] = tx['product_description'].apply(extract_pack_size)
-tx['brand_guess'] = tx['product_description'].apply(extract_brand)
-
-# merge with customers
-merged = tx.merge(cust, how='left', on='customer_id')
-
-# flag chips
-merged['is_chips'] = merged['product_description'].str.lower().str.contains('chip|crisp|potato|dorito|doritos', na=False)
-
-# keep only chips for this analysis
-chips = merged[merged['is_chips']].copy()
-
-# remove problematic rows
-chips = chips[(chips['quantity']>0) & (chips['price']>0) & chips['transaction_id'].notnull() & chips['customer_id'].notnull()]
-
-# Save cleaned chips dataset
-chips.to_csv(OUT_DIR / 'tx_chips_clean.csv', index=False)
+if BACKEND == 'duckdb':
+    # out-of-core: the transactions are never loaded into pandas
+    from chips_lazy import connect, distinct_values, prep_chips
+    con = connect()
+    tx_parquet = transactions_parquet(TXN_XLSX, sheet_name='in', cache_dir=CACHE_DIR)
+    products = update_product_lookup(load_product_lookup(PRODUCT_LOOKUP), distinct_values(tx_parquet, 'product_description', con))
+    save_product_lookup(products, PRODUCT_LOOKUP)
+    # writes tx_chips_clean.parquet/.csv and its cube (read by 011), returns the small frames used below
+    with stage('prep_chips', backend=BACKEND):
+        res = prep_chips(tx_parquet, cust, products, OUT_DIR / 'tx_chips_clean', con=con)
+    rfm_st, qty_pairs, cube = res['rfm_state'], res['qty_pairs'], res['cube']
+
+else:
+    # --- load data ---
+    # first sheet named 'in' in your file — adjust name if different
+    # dates are converted in one vectorized pass; the typed table is cached under CACHE_DIR
+    with stage('load_transactions') as st:
+        tx = load_transactions(TXN_XLSX, sheet_name='in', cache_dir=CACHE_DIR)
+        st.rows_out = len(tx)
+
+    # numeric conversions happen in load_transactions
+    tx['price'] = tx['line_total'] / tx['quantity']
+
+    # derive brand, pack size and chips flag once per distinct description (see qvi_products.py)
+    with stage('product_attributes', rows_in=len(tx)) as st:
+        products = update_product_lookup(load_product_lookup(PRODUCT_LOOKUP), tx['product_description'])
+        save_product_lookup(products, PRODUCT_LOOKUP)
+        tx = tx.join(product_attributes(tx['product_description'], products))
+        st.rows_out = len(tx)
+
+    # merge with customers
+    with stage('merge_customers', rows_in=len(tx)) as st:
+        merged = tx.merge(cust, how='left', on='customer_id')
+        st.rows_out = len(merged)
+
+    # flag chips (computed with the product attributes; keep it as the last column)
+    merged['is_chips'] = merged.pop('is_chips')
+
+    # keep only chips for this analysis and remove problematic rows: the QVI rule set
+    # (chips_clean.qvi_chips_rules) in one bitmask pass; each rule's removed rows are logged
+    with stage('chips_filter', rows_in=len(merged)) as st:
+        res = evaluate(merged, qvi_chips_rules(), actions=RULE_ACTIONS)
+        chips, quarantine = res.split(merged)
+        for rule, n in res.removed().items():
+            st.drop(rule, n)
+        st.rows_out = len(chips)
+    if len(quarantine):
+        write_table(quarantine, OUT_DIR / 'tx_chips_quarantine')   # rows of 'quarantine' rules, with failed_rules
+
+    # Save cleaned chips dataset (typed Parquet for the Python stages; CSV copy for the R scripts)
+    with stage('write_chips', rows_in=len(chips)):
+        write_table(chips, OUT_DIR / 'tx_chips_clean')
+        chips.to_csv(OUT_DIR / 'tx_chips_clean.csv', index=False)
+
+    # vectorized per-customer state; chips_rfm.RFMStore folds new daily batches into the same state
+    with stage('rfm_state', rows_in=len(chips)) as st:
+        rfm_st, qty_pairs = rfm_state(chips, date_col='date')
+        st.rows_out = len(rfm_st)
+
+    # store x day x sku sales cube (chips_cube.py); the reports below are roll-ups of it
+    with stage('cube_build', rows_in=len(chips)) as st:
+        cube = SalesCube.build(chips, date_col='date')
+        st.rows_out = len(cube.cells)
+
+    # saved next to the source table, so 011 (SalesCube.for_table) reuses it instead of rescanning the lines
+    cube.save(cube_dir_for(OUT_DIR / 'tx_chips_clean'), source=resolve(OUT_DIR / 'tx_chips_clean'))
+
+if VERIFY_CUBE:
+    cube.verify(read_table(OUT_DIR / 'tx_chips_clean', columns=['date'] + LINE_COLUMNS))
 
 # --- Customer RFM (chips customers) ---
-snapshot_date = chips['date'].max() + pd.Timedelta(days=1)
-rfm = chips.groupby('customer_id').agg(
-    recency_days = ('date', lambda x: (snapshot_date - x.max()).days),
-    frequency = ('transaction_id', 'nunique'),
-    monetary = ('line_total', 'sum'),
-    units = ('quantity', 'sum'),
-    avg_units_per_tx = ('quantity', lambda s: s.sum()/s.nunique())
-).reset_index()
-
-# RFM Scoring (quintiles)
-rfm['r_score'] = pd.qcut(rfm['recency_days'].rank(method='first'), 5, labels=[5,4,3,2,1]).astype(int)
-rfm['f_score'] = pd.qcut(rfm['frequency'].rank(method='first'), 5, labels=[1,2,3,4,5]).astype(int)
-rfm['m_score'] = pd.qcut(rfm['monetary'].rank(method='first'), 5, labels=[1,2,3,4,5]).astype(int)
-rfm['rfm_score'] = rfm['r_score'].astype(str)+rfm['f_score'].astype(str)+rfm['m_score'].astype(str)
+with stage('rfm_score') as st:
+    rfm = rfm_table(rfm_st, qty_pairs)
+
+    # RFM Scoring (quintiles)
+    rfm = score_rfm(rfm)
+    st.rows_out = len(rfm)
 
 rfm.to_csv(OUT_DIR / 'chips_customers_rfm.csv', index=False)
+if VERIFY_RFM:
+    lines = read_table(OUT_DIR / 'tx_chips_clean', columns=['date', 'customer_id', 'transaction_id', 'line_total', 'quantity'])
+    store = RFMStore()
+    for _, batch in lines.groupby(lines['date'].dt.to_period('M')):
+        store.fold(batch)
+    store.verify(rfm)
 
 # --- Aggregations for reporting ---
-pack_agg = chips.groupby('pack_size').agg(units_sold=('quantity','sum'), revenue=('line_total','sum'), transactions=('transaction_id','nunique')).reset_index().sort_values('units_sold', ascending=False)
-brand_agg = chips.groupby('brand_guess').agg(units_sold=('quantity','sum'), revenue=('line_total','sum')).reset_index().sort_values('units_sold', ascending=False)
+agg_names = {'quantity': 'units_sold', 'line_total': 'revenue'}
+pack_agg = cube.rollup(['pack_size'], ['quantity','line_total','transactions']).rename(columns=agg_names).sort_values('units_sold', ascending=False)
+brand_agg = cube.rollup(['brand_guess'], ['quantity','line_total']).rename(columns=agg_names).sort_values('units_sold', ascending=False)
 
 pack_agg.to_csv(OUT_DIR / 'chips_sales_by_pack_size.csv', index=False)
 brand_agg.to_csv(OUT_DIR / 'chips_sales_by_brand_guess.csv', index=False)
 
-# --- Simple plots (matplotlib, one plot per file) ---
-daily = chips.groupby(chips['date'].dt.date)['line_total'].sum().reset_index()
-daily['date'] = pd.to_datetime(daily['date'])
-plt.figure(figsize=(10,4))
-plt.plot(daily['date'], daily['line_total'])
-plt.title('Daily Chips Revenue')
-plt.ylabel('Revenue')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig(OUT_DIR / 'fig_daily_chips_revenue.png')
-plt.close()
+# --- Simple plots (one plot per file; skipped when the series is unchanged, see qvi_charts.py) ---
+daily = cube.rollup(['date'], ['line_total'])
+render_all([ChartSpec(str(OUT_DIR / 'fig_daily_chips_revenue.png'), 'line',
+                      {'series': [(None, daily['date'].to_numpy(), daily['line_total'].to_numpy())]},
+                      {'figsize': (10,4), 'title': 'Daily Chips Revenue', 'ylabel': 'Revenue', 'xrot': 45, 'tight': True})])
 
 # done
-print("Saved: tx_chips_clean.csv, chips_customers_rfm.csv, chips_sales_by_pack_size.csv, chips_sales_by_brand_guess.csv, fig_daily_chips_revenue.png")
+print("Saved: tx_chips_clean.parquet/.csv, chips_customers_rfm.csv, chips_sales_by_pack_size.csv, chips_sales_by_brand_guess.csv, fig_daily_chips_revenue.png")
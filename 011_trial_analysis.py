@@ -6,6 +6,8 @@ Run: python trial_analysis.py
 Outputs:
  - outputs/match_table.csv
  - outputs/store_results.csv
+ - outputs/placebo_null.csv (PLACEBO = True)
+ - outputs/window_sweep.csv (SWEEP_STARTS set)
  - outputs/<store_id>_timeseries.png
  - outputs/<store_id>_prepost_bar.png
 """
@@ -13,101 +15,63 @@ Outputs:
 import pandas as pd
 import numpy as np
 from pathlib import Path
-import matplotlib.pyplot as plt
-import statsmodels.formula.api as smf
-from sklearn.preprocessing import StandardScaler
-from sklearn.neighbors import NearestNeighbors
 from scipy import stats
 import math
+from concurrent.futures import ProcessPoolExecutor
+from trial_bootstrap import bootstrap_ci
+from trial_did import did_hc1, did_statsmodels
+from trial_placebo import placebo_null, placebo_pvalues
+from trial_matching import StoreSimilarity
+from chips_cube import SalesCube
+from trial_panel import StorePanel
+from qvi_charts import ChartSpec, render_all
+from qvi_instrument import stage
 
 OUT = Path("outputs"); OUT.mkdir(exist_ok=True)
 
 # ------------- Parameters to set -------------
-TX_CSV = "tx_chips_clean.csv"   # cleaned chips transactions
+TX_TABLE = "tx_chips_clean"    # cleaned chips transactions (.parquet/.feather/.csv, see qvi_schema.py)
 TRIAL_STORES = [101, 102]       # replace with actual trial store ids
 TRIAL_START = pd.to_datetime("2019-03-01")  # change to actual trial start
 TRIAL_END   = pd.to_datetime("2019-03-31")  # trial end
 PRE_PERIOD_WEEKS = 8
 N_CONTROLS = 2                   # number of matched controls per trial store
+MATCH_FREQ = 'W'                 # pre-period series used for matching: 'W' weekly or 'D' daily
 ALPHA = 0.05                      # significance level
+NBOOT = 2000                      # bootstrap resamples per trial store
+BOOT_BLOCK = None                 # None: resample days; e.g. 7 for a weekly moving-block bootstrap
+BOOT_SEED = 42                    # each store's stream is seeded from (BOOT_SEED, store_id)
+N_WORKERS = None                  # trial stores run in a process pool (None = all cores, 1 = serial)
+VERIFY_DID = False                # True: re-fit each store with statsmodels and check the closed-form DiD
+PLACEBO = False                   # True: every non-trial store as a pseudo-trial -> empirical null of uplift
+SWEEP_STARTS = None               # e.g. pd.date_range("2019-02-01", "2019-04-01", freq="7D"): scan candidate trial starts
+SWEEP_LENGTHS = [28]              # trial window lengths (days) scanned for every start
 # --------------------------------------------
 
-# Load data
-tx = pd.read_csv(TX_CSV, parse_dates=['date'])
-tx = tx[tx['is_chips'].astype(bool)]   # ensure chips only
-
-# create daily store-level aggregates
-daily = tx.groupby(['store_id','date']).agg(
-    daily_revenue=('line_total','sum'),
-    daily_units=('quantity','sum'),
-    daily_txns=('transaction_id','nunique')
-).reset_index()
-
-# Helper: pre and post masks
+# Helper: pre and post window bounds
 trial_start = TRIAL_START
 pre_start = TRIAL_START - pd.Timedelta(weeks=PRE_PERIOD_WEEKS)
-pre_mask = (daily['date'] >= pre_start) & (daily['date'] < trial_start)
-post_mask = (daily['date'] >= TRIAL_START) & (daily['date'] <= TRIAL_END)
-
-# compute pre-period summary features per store for matching
-pre = daily[pre_mask].copy()
-store_features = pre.groupby('store_id').agg(
-    pre_mean_rev=('daily_revenue','mean'),
-    pre_median_rev=('daily_revenue','median'),
-    pre_std_rev=('daily_revenue','std'),
-    pre_mean_units=('daily_units','mean'),
-    pre_weekday_pattern = ('daily_revenue', lambda s: s.groupby(s.index % 7).mean().mean()) # simple
-).reset_index()
-
-# more robust: weekday pattern vector (mon-sun) - build matrix
-# We'll compute mean revenue by weekday for each store (0..6)
-weekday = pre.copy()
-weekday['weekday'] = weekday['date'].dt.weekday
-wk_pivot = weekday.pivot_table(index='store_id', columns='weekday', values='daily_revenue', aggfunc='mean', fill_value=0)
-# Merge pivot into store_features
-store_features = store_features.merge(wk_pivot.reset_index(), on='store_id', how='left')
-
-# Matching: scale features & use nearest neighbors
-feature_cols = [c for c in store_features.columns if c not in ['store_id']]
-X = store_features[feature_cols].fillna(0).values
-scaler = StandardScaler()
-Xs = scaler.fit_transform(X)
-
-nbrs = NearestNeighbors(n_neighbors=N_CONTROLS+1, algorithm='auto').fit(Xs)  # +1 because neighbor includes itself
-distances, indices = nbrs.kneighbors(Xs)
-
-# Build match table
-match_rows = []
-for i, sid in enumerate(store_features['store_id'].values):
-    neigh = indices[i,1:1+N_CONTROLS]  # skip index 0 = itself
-    controls = store_features['store_id'].values[neigh].tolist()
-    match_rows.append({'store_id': sid, 'controls': controls, 'distances': distances[i,1:1+N_CONTROLS].tolist()})
-match_df = pd.DataFrame(match_rows)
-match_df.to_csv(OUT / "match_table.csv", index=False)
-
-# For each trial store, pick its matched controls and run DiD
-results = []
-for trial in TRIAL_STORES:
-    # find controls from match_df
-    ctrls = match_df.loc[match_df['store_id']==trial,'controls'].iloc[0]
-    print("Trial", trial, "controls", ctrls)
-
-    # subset daily data for trial + controls for pre+post window
-    mask = (daily['store_id'].isin([trial]+ctrls)) & (daily['date'] >= pre_start) & (daily['date'] <= TRIAL_END)
-    df = daily[mask].copy()
 
+
+def label_panel(trial, df):
     # label store type and period
+    df = df.copy()
+    df['panel'] = trial
     df['is_trial'] = (df['store_id'] == trial).astype(int)
     df['period'] = np.where(df['date'] >= trial_start, 'post', 'pre')
     df['post'] = (df['period']=='post').astype(int)
+    return df
 
-    # DID regression: daily_revenue ~ is_trial + post + is_trial:post + store_fe + date_fe(optional)
-    # add store fixed effects via store dummies
-    df['store_id_str'] = df['store_id'].astype(str)
-    model = smf.ols('daily_revenue ~ is_trial + post + is_trial:post + C(store_id_str)', data=df).fit(cov_type='HC1')
-    coef = model.params.get('is_trial:post', np.nan)
-    se = model.bse.get('is_trial:post', np.nan)
-    pval = model.pvalues.get('is_trial:post', np.nan)
+
+def analyze_trial_store(trial, ctrls, df, did):
+    """Summary means, bootstrap CI and figure specs for one trial store.
+
+    `df` is the labelled daily panel (label_panel) of the trial store and its
+    controls over the pre+post window; `did` is its (coef, se, pval) row from
+    did_hc1. Runs in a worker process; the bootstrap stream depends only on
+    (BOOT_SEED, trial), so results do not depend on N_WORKERS.
+    """
+    coef, se, pval = did
     # compute agg means
     mean_pre_trial = df[(df['is_trial']==1) & (df['post']==0)]['daily_revenue'].mean()
     mean_post_trial = df[(df['is_trial']==1) & (df['post']==1)]['daily_revenue'].mean()
@@ -115,8 +79,7 @@ for trial in TRIAL_STORES:
     mean_post_ctrl = df[(df['is_trial']==0) & (df['post']==1)]['daily_revenue'].mean()
     # DiD naive estimate:
     did_point = (mean_post_trial - mean_pre_trial) - (mean_post_ctrl - mean_pre_ctrl)
-    # Save results
-    results.append({
+    result = {
         'trial_store': trial,
         'controls': ctrls,
         'did_coef': coef,
@@ -127,7 +90,7 @@ for trial in TRIAL_STORES:
         'mean_post_trial': mean_post_trial,
         'mean_pre_ctrl': mean_pre_ctrl,
         'mean_post_ctrl': mean_post_ctrl
-    })
+    }
 
     # bootstrap CI for agg point estimate (store-level daily diffs)
     # compute daily diff series: diff = (trial_daily_rev - avg_ctrl_daily_rev) for days
@@ -136,49 +99,118 @@ for trial in TRIAL_STORES:
     merged_series = trial_series.join(ctrl_series, lsuffix='_trial', rsuffix='_ctrl', how='inner').dropna()
     merged_series['diff'] = merged_series['daily_revenue_trial'] - merged_series['daily_revenue_ctrl']
 
-    # bootstrap on days
-    nboot = 2000
-    boot_means = []
-    merged_vals = merged_series['diff'].values
-    rng = np.random.default_rng(42)
-    for _ in range(nboot):
-        sample = rng.choice(merged_vals, size=len(merged_vals), replace=True)
-        boot_means.append(sample.mean())
-    ci_low = np.percentile(boot_means, 2.5)
-    ci_high = np.percentile(boot_means, 97.5)
-
-    # viz: time series with pre/post shaded
-    fig, ax = plt.subplots(figsize=(10,4))
-    # plot trial and avg control
+    # bootstrap on days (or on blocks of BOOT_BLOCK consecutive days), vectorized in batches
+    rng = np.random.default_rng([BOOT_SEED, int(trial)])
+    ci_low, ci_high = bootstrap_ci(merged_series['diff'].values, nboot=NBOOT, rng=rng, block_size=BOOT_BLOCK)
+
+    # figures as small series (rendered together by the main process, see qvi_charts.py)
+    # time series: trial and avg control daily revenue, trial start marked
     df_plot = df.groupby(['date','is_trial']).daily_revenue.mean().reset_index()
-    for is_t, group in df_plot.groupby('is_trial'):
-        label = 'Trial' if is_t==1 else 'Controls (avg)'
-        ax.plot(group['date'], group['daily_revenue'], label=label)
-    ax.axvline(trial_start, color='k', linestyle='--', label='Trial start')
-    ax.set_title(f"Store {trial} - Daily revenue (trial vs controls)")
-    ax.legend()
-    fig.savefig(OUT / f"{trial}_timeseries.png")
-    plt.close(fig)
-
-    # bar: pre vs post mean (trial vs controls)
-    fig, ax = plt.subplots(figsize=(6,4))
-    bars = [mean_pre_trial, mean_post_trial, mean_pre_ctrl, mean_post_ctrl]
-    labels = ['Trial Pre','Trial Post','Ctrl Pre','Ctrl Post']
-    ax.bar(labels, bars)
-    ax.set_title(f"Store {trial} - Pre/Post avg daily revenue")
-    fig.savefig(OUT / f"{trial}_prepost_bar.png")
-    plt.close(fig)
+    series = [('Trial' if is_t==1 else 'Controls (avg)', group['date'].to_numpy(), group['daily_revenue'].to_numpy())
+              for is_t, group in df_plot.groupby('is_trial')]
+    specs = [
+        ChartSpec(str(OUT / f"{trial}_timeseries.png"), 'line',
+                  {'series': series, 'vline': trial_start, 'vline_label': 'Trial start'},
+                  {'figsize': (10,4), 'title': f"Store {trial} - Daily revenue (trial vs controls)", 'legend': True}),
+        # bar: pre vs post mean (trial vs controls)
+        ChartSpec(str(OUT / f"{trial}_prepost_bar.png"), 'bar',
+                  {'labels': ['Trial Pre','Trial Post','Ctrl Pre','Ctrl Post'],
+                   'values': [mean_pre_trial, mean_post_trial, mean_pre_ctrl, mean_post_ctrl]},
+                  {'figsize': (6,4), 'title': f"Store {trial} - Pre/Post avg daily revenue"})
+    ]
 
     # append bootstrap CI
-    results[-1].update({'boot_mean_diff': merged_series['diff'].mean(), 'boot_ci_low': ci_low, 'boot_ci_high': ci_high})
-
-res_df = pd.DataFrame(results)
-# multiple testing correction (BH)
-from statsmodels.stats.multitest import multipletests
-pvals = res_df['did_pval'].fillna(1).values
-rej, pvals_corr, _, _ = multipletests(pvals, alpha=ALPHA, method='fdr_bh')
-res_df['pval_adj_bh'] = pvals_corr
-res_df['reject_bh'] = rej
-res_df.to_csv(OUT / "store_results.csv", index=False)
-
-print("Done. Outputs in", OUT)
+    result.update({'boot_mean_diff': merged_series['diff'].mean(), 'boot_ci_low': ci_low, 'boot_ci_high': ci_high})
+    return result, specs
+
+
+if __name__ == '__main__':
+    # Daily store-level aggregates (revenue, units, transactions, customers), rolled up from the
+    # chips sales cube of TX_TABLE; the cube is rebuilt only when the table changes (see chips_cube.py)
+    # (each step appends a timing/memory/row-flow record to .cache/stages.jsonl, see qvi_instrument.py)
+    with stage('store_daily') as st:
+        daily = SalesCube.for_table(TX_TABLE).store_daily()
+        st.rows_out = len(daily)
+    # dense store x day arrays of the same metrics: windows are slices / prefix-sum differences (see trial_panel.py)
+    with stage('panel', rows_in=len(daily)):
+        panel = StorePanel.from_daily(daily)
+
+    # Matching: Pearson correlation + normalized magnitude distance of each store's
+    # pre-period revenue and customer series against every non-trial store (see trial_matching.py);
+    # the similarity matrix is cached per pre-period window
+    with stage('matching', rows_in=len(daily)) as st:
+        sim = StoreSimilarity.build(daily, pre_start, trial_start, exclude=TRIAL_STORES, freq=MATCH_FREQ)
+
+        # Build match table (trial stores only; any other store is a row lookup in sim)
+        match_rows = []
+        for sid in TRIAL_STORES:
+            match_rows.append({'store_id': sid, 'controls': sim.controls(sid, N_CONTROLS), 'scores': sim.control_scores(sid, N_CONTROLS)})
+        match_df = pd.DataFrame(match_rows)
+        st.rows_out = len(match_df)
+        st.note(controls={str(r['store_id']): r['controls'] for r in match_rows})
+    match_df.to_csv(OUT / "match_table.csv", index=False)
+
+    # For each trial store, pick its matched controls and subset the daily panel;
+    # only these small frames are sent to the workers
+    jobs = []
+    for trial in TRIAL_STORES:
+        # find controls from match_df
+        ctrls = match_df.loc[match_df['store_id']==trial,'controls'].iloc[0]
+        print("Trial", trial, "controls", ctrls)
+
+        # daily rows of trial + controls for the pre+post window (a slice of the panel arrays)
+        jobs.append((trial, ctrls, label_panel(trial, panel.long_frame([trial]+ctrls, pre_start, TRIAL_END))))
+
+    # DID regression: daily_revenue ~ is_trial + post + is_trial:post + store_fe, HC1 errors,
+    # solved in closed form for all trial stores at once (see trial_did.py)
+    with stage('did', rows_in=sum(len(df) for _, _, df in jobs)) as st:
+        did = did_hc1(pd.concat([df for _, _, df in jobs]))
+        did_rows = [tuple(did.loc[trial, ['did_coef','did_se','did_pval']]) for trial, _, _ in jobs]
+        st.rows_out = len(did)
+    if VERIFY_DID:
+        for (trial, _, df), row in zip(jobs, did_rows):
+            np.testing.assert_allclose(did_statsmodels(df), row, rtol=1e-8, err_msg=f"DiD mismatch for store {trial}")
+
+    # run bootstrap per trial store; map() keeps TRIAL_STORES order
+    # (CPU time in the record covers this process only, not the pool workers)
+    with stage('bootstrap', rows_in=len(jobs), nboot=NBOOT, n_workers=N_WORKERS) as st:
+        if N_WORKERS == 1:
+            out = [analyze_trial_store(*job, row) for job, row in zip(jobs, did_rows)]
+        else:
+            with ProcessPoolExecutor(max_workers=N_WORKERS) as ex:
+                out = list(ex.map(analyze_trial_store, *zip(*jobs), did_rows))
+        results = [r for r, _ in out]
+        st.rows_out = len(results)
+    # per-store figures, rendered in a pool; figures whose series and style are unchanged are skipped
+    with stage('render') as st:
+        rendered, skipped = render_all([spec for _, specs in out for spec in specs], n_workers=N_WORKERS)
+        st.note(rendered=len(rendered), skipped=len(skipped))
+
+    res_df = pd.DataFrame(results)
+    # multiple testing correction (BH)
+    from statsmodels.stats.multitest import multipletests
+    pvals = res_df['did_pval'].fillna(1).values
+    rej, pvals_corr, _, _ = multipletests(pvals, alpha=ALPHA, method='fdr_bh')
+    res_df['pval_adj_bh'] = pvals_corr
+    res_df['reject_bh'] = rej
+
+    # placebo inference: DiD of every non-trial store against its own matched controls
+    if PLACEBO:
+        with stage('placebo') as st:
+            matches = {s: sim.controls(s, N_CONTROLS) for s in sim.stores if s not in TRIAL_STORES}
+            null = placebo_null(daily, matches, pre_start, TRIAL_START, TRIAL_END, n_workers=N_WORKERS)
+            st.rows_in, st.rows_out = len(matches), len(null)
+        null.to_csv(OUT / "placebo_null.csv")
+        res_df = res_df.join(placebo_pvalues(null, res_df.set_index('trial_store')['did_coef']), on='trial_store')
+    res_df.to_csv(OUT / "store_results.csv", index=False)
+
+    # window sweep: pre/post means, uplift and pre-period fit of each trial store against its
+    # matched controls for every candidate start and length, from the panel's prefix sums
+    if SWEEP_STARTS is not None:
+        matches = {s: sim.controls(s, N_CONTROLS) for s in TRIAL_STORES}
+        with stage('window_sweep', rows_in=len(matches)) as st:
+            sweep = panel.window_sweep(matches, SWEEP_STARTS, SWEEP_LENGTHS, pre_days=PRE_PERIOD_WEEKS * 7)
+            st.rows_out = len(sweep)
+        sweep.to_csv(OUT / "window_sweep.csv", index=False)
+
+    print("Done. Outputs in", OUT)
@@ -0,0 +1,276 @@
+# Scaling benchmark: time and memory of each analysis stage on synthetic QVI data
+
+# benchmark.py
+# Run: python benchmark.py 100k 1M                  # measure, print, compare with the baseline if present
+#      python benchmark.py 100k 1M --save-baseline  # store these results as the baseline
+#      python benchmark.py 1M --stages rfm kmeans --fail-on-regression
+#      python benchmark.py 1M --trace-alloc            # also record peak traced allocations
+#
+# Each size gets a seeded synthetic dataset (qvi_synth.py, generated once under
+# DATA_DIR) and runs the stage chain in-process on it: ingest, date parsing,
+# attribute extraction, customer merge, RFM, k selection, basket co-occurrence,
+# control matching, DiD and bootstrap, with the same helpers the scripts use.
+# Per stage it records wall and CPU time (this process only; joblib workers are
+# not included), the RSS afterwards and the peak RSS reached inside the stage with
+# its rise over the RSS at the start (peak_rss_delta_mb, what the baseline
+# comparison uses). On Linux the kernel high-water mark is reset before each
+# stage, so the peak is the stage's own, transient spikes included; elsewhere it
+# is the process ru_maxrss when the stage raised it, else the larger of the start
+# and end RSS (a lower bound). Memory the allocator kept from earlier stages is
+# reused without raising RSS, so the delta is the stage's extra footprint. With
+# --trace-alloc also the peak of traced allocations (tracemalloc, numpy
+# included), an optional extra: tracing slows allocation-heavy stages such as
+# ingest many times over, so run it separately from timing runs. The k stage scores silhouettes on SILHOUETTE_SAMPLE rows
+# (smaller than 004's) to keep the suite tractable; its cost grows with that
+# sample squared, not with the line count. Results are written to BENCH_DIR as
+# JSON; a stage slower or larger than TOLERANCE x the baseline is a regression.
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from qvi_synth import SYNTH_VERSION, parse_size
+from qvi_ingest import load_transactions, excel_serial_to_dates
+from qvi_products import empty_lookup, update_product_lookup, product_attributes
+from chips_rfm import rfm_state, rfm_table, score_rfm
+from chips_clusters import customer_features, scaled_features, select_k
+from chips_basket import incidence, association_rules
+from chips_cube import SalesCube
+from trial_matching import StoreSimilarity
+from trial_panel import StorePanel
+from trial_did import did_hc1
+from trial_bootstrap import bootstrap_ci
+from qvi_instrument import peak_rss_mb, rss_mb
+from qvi_rules import evaluate
+from chips_clean import qvi_chips_rules
+
+BENCH_DIR = Path('benchmarks')
+BASELINE = BENCH_DIR / 'baseline.json'
+DATA_DIR = Path('.cache') / 'synth'
+STAGES = ['ingest', 'dates', 'attributes', 'merge', 'rfm', 'kmeans', 'basket', 'matching', 'did', 'bootstrap']
+TOLERANCE = 1.25        # ratio to baseline counted as a regression
+MIN_SECONDS = 0.05      # shorter stages are too noisy to flag on time
+MIN_MB = 20             # smaller peak RSS rises are too noisy to flag on memory
+
+# trial settings as in 011_trial_analysis.py
+TRIAL_START = pd.Timestamp('2019-03-01')
+TRIAL_END = pd.Timestamp('2019-03-31')
+PRE_START = TRIAL_START - pd.Timedelta(weeks=8)
+N_CONTROLS = 2
+NBOOT = 2000
+BOOT_STORES = 50        # stores bootstrapped per size
+KS = range(2, 7)
+SILHOUETTE_SAMPLE = 5_000
+
+
+def _proc_status_mb(field):
+    # VmRSS / VmHWM of this process from /proc (Linux), None elsewhere
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2**10   # kB
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    # Linux: reset VmHWM to the current RSS (ru_maxrss itself cannot be reset)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return _proc_status_mb('VmHWM') is not None
+
+
+def _rss():
+    return _proc_status_mb('VmRSS') or rss_mb()
+
+
+class Recorder:
+    """Context manager factory: `with rec('rfm'): ...` appends one measurement."""
+
+    def __init__(self, size, trace=False):
+        self.size = size
+        self.trace = trace
+        self.records = []
+
+    @contextmanager
+    def __call__(self, stage, rows=None):
+        gc.collect()
+        if self.trace:
+            tracemalloc.start()
+        hwm0 = peak_rss_mb()
+        own_peak = _reset_peak_rss()
+        rss0 = _rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        rss = _rss()
+        if own_peak:
+            peak_rss = max(_proc_status_mb('VmHWM'), rss0, rss)   # VmHWM can trail VmRSS by a few pages
+        else:
+            hwm = peak_rss_mb()
+            peak_rss = hwm if hwm is not None and hwm0 is not None and hwm > hwm0 else max(rss0, rss)
+        alloc = None
+        if self.trace:
+            alloc = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self.records.append({'size': self.size, 'stage': stage, 'rows': rows, 'wall_s': wall, 'cpu_s': cpu,
+                             'peak_rss_mb': peak_rss, 'peak_rss_delta_mb': peak_rss - rss0, 'rss_mb': rss,
+                             'peak_alloc_mb': alloc})
+        print(f'  {stage:<11} {wall:8.2f}s  peak rss +{peak_rss - rss0:8.1f} MB'
+              + (f'  peak alloc {alloc:8.1f} MB' if alloc is not None else ''), flush=True)
+
+
+def dataset(n, seed, data_dir=DATA_DIR):
+    """Synthetic transaction/customer CSVs for `n` lines, generated once per (size, seed, generator version)."""
+    out = Path(data_dir) / f'{n}-s{seed}-v{SYNTH_VERSION}'
+    tx_path, cust_path = out / 'QVI_transaction_data.csv', out / 'QVI_purchase_behaviour.csv'
+    if not (tx_path.exists() and cust_path.exists()):
+        print(f'generating {n:,} lines -> {out}', flush=True)
+        # in a child process, so the generator's heap does not shape this process's RSS
+        subprocess.run([sys.executable, str(Path(__file__).with_name('qvi_synth.py')), str(n), str(out), '--seed', str(seed)],
+                       check=True, stdout=subprocess.DEVNULL)
+    return tx_path, cust_path
+
+
+def run_size(n, seed=0, stages=STAGES, trace=False, data_dir=DATA_DIR):
+    """Run the stage chain on one dataset size; returns the measurement records.
+
+    Stages not selected still run (later stages need their output) but are not recorded.
+    """
+    tx_path, cust_path = dataset(n, seed, data_dir)
+    rec = Recorder(n, trace)
+
+    @contextmanager
+    def stage(name, rows=None):
+        if name in stages:
+            with rec(name, rows):
+                yield
+        else:
+            yield
+
+    print(f'size {n:,}', flush=True)
+    with stage('ingest', n):
+        tx = load_transactions(tx_path, use_cache=False)
+    raw_dates = pd.read_csv(tx_path, usecols=['DATE'], dtype=object)['DATE']
+    with stage('dates', len(raw_dates)):
+        excel_serial_to_dates(raw_dates)
+    del raw_dates
+
+    with stage('attributes', len(tx)):
+        products = update_product_lookup(empty_lookup(), tx['product_description'])
+        tx = tx.join(product_attributes(tx['product_description'], products))
+
+    cust = pd.read_csv(cust_path)
+    cust.columns = [c.strip().lower() for c in cust.columns]
+    cust = cust.rename(columns={'lylty_card_nbr': 'customer_id'})
+    with stage('merge', len(tx)):
+        tx['price'] = tx['line_total'] / tx['quantity']
+        merged = tx.merge(cust, how='left', on='customer_id')
+        chips, _ = evaluate(merged, qvi_chips_rules()).split(merged)
+    del tx, merged
+
+    with stage('rfm', len(chips)):
+        state, qty_pairs = rfm_state(chips, date_col='date')
+        score_rfm(rfm_table(state, qty_pairs))
+
+    with stage('kmeans', len(state)):
+        select_k(scaled_features(customer_features(chips)), ks=KS, sample_size=SILHOUETTE_SAMPLE)
+
+    with stage('basket', len(chips)):
+        X, _, items = incidence(chips, 'sku')
+        association_rules(X, items, min_support=0.001, top_k=10)
+
+    daily = SalesCube.build(chips).store_daily()
+    del chips
+    with stage('matching', len(daily)):
+        sim = StoreSimilarity.build(daily, PRE_START, TRIAL_START, cache_dir=None)
+        matches = {s: sim.controls(s, N_CONTROLS) for s in sim.stores}
+
+    panel = StorePanel.from_daily(daily, ['daily_revenue'])
+    with stage('did', len(matches)):
+        # every store as a trial against its matched controls, one batched fit
+        frames = []
+        for s, ctrls in matches.items():
+            df = panel.long_frame([s] + ctrls, PRE_START, TRIAL_END)
+            df['panel'] = s
+            df['is_trial'] = (df['store_id'] == s).astype(int)
+            df['post'] = (df['date'] >= TRIAL_START).astype(int)
+            frames.append(df)
+        did_hc1(pd.concat(frames, ignore_index=True))
+
+    boot = list(matches.items())[:BOOT_STORES]
+    with stage('bootstrap', len(boot)):
+        lo, hi = panel.day(PRE_START), panel.day(TRIAL_END) + 1
+        for s, ctrls in boot:
+            x = panel.values['daily_revenue'][panel.row[s], lo:hi]
+            ctrl = panel.values['daily_revenue'][panel.row.loc[ctrls].to_numpy(), lo:hi]
+            with np.errstate(invalid='ignore'):   # days no control has a row -> NaN, dropped below
+                c = np.nansum(ctrl, axis=0) / (~np.isnan(ctrl)).sum(axis=0)
+            diff = (x - c)[~np.isnan(x - c)]
+            bootstrap_ci(diff, nboot=NBOOT, rng=np.random.default_rng([seed, int(s)]))
+    return rec.records
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Join results with the baseline; flag time, peak RSS and (when both traced) allocation ratios above `tolerance`."""
+    cols = ['wall_s', 'peak_rss_delta_mb', 'peak_alloc_mb']
+    cur = pd.DataFrame(results).set_index(['size', 'stage']).reindex(columns=cols)
+    base = pd.DataFrame(baseline['results']).set_index(['size', 'stage']).reindex(columns=cols)
+    cmp = cur.join(base, rsuffix='_base', how='inner').astype(float)
+    cmp['time_ratio'] = cmp['wall_s'] / cmp['wall_s_base']
+    cmp['mem_ratio'] = cmp['peak_rss_delta_mb'] / cmp['peak_rss_delta_mb_base'].clip(lower=MIN_MB)
+    cmp['alloc_ratio'] = cmp['peak_alloc_mb'] / cmp['peak_alloc_mb_base']   # NaN unless both runs traced
+    cmp['regression'] = (((cmp['time_ratio'] > tolerance) & (cmp['wall_s'] > MIN_SECONDS))
+                         | ((cmp['mem_ratio'] > tolerance) & (cmp['peak_rss_delta_mb'] > MIN_MB))
+                         | (cmp['alloc_ratio'] > tolerance))
+    return cmp
+
+
+def environment():
+    return {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'machine': platform.machine()}
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Time and memory-profile the analysis stages on synthetic data.')
+    ap.add_argument('sizes', nargs='*', default=['100k', '1M'], help='dataset sizes in lines (100k, 1M, 100M, ...)')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    ap.add_argument('--trace-alloc', action='store_true', help='also record peak_alloc_mb with tracemalloc (slows stages)')
+    ap.add_argument('--save-baseline', action='store_true', help=f'write the results to {BASELINE}')
+    ap.add_argument('--fail-on-regression', action='store_true', help='exit 1 if any stage regressed vs the baseline')
+    args = ap.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results += run_size(parse_size(size), args.seed, args.stages, args.trace_alloc)
+        gc.collect()
+
+    report = {'environment': environment(), 'seed': args.seed, 'results': results}
+    BENCH_DIR.mkdir(exist_ok=True)
+    out = BENCH_DIR / f'results-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    out.write_text(json.dumps(report, indent=1))
+    print('\n' + pd.DataFrame(results).set_index(['size', 'stage']).round(3).to_string())
+    print('wrote', out)
+
+    regressed = False
+    if BASELINE.exists() and not args.save_baseline:
+        cmp = compare(results, json.loads(BASELINE.read_text()))
+        print('\nvs baseline:\n' + cmp[['time_ratio', 'mem_ratio', 'alloc_ratio', 'regression']].round(2).to_string())
+        regressed = bool(cmp['regression'].any())
+    if args.save_baseline:
+        BASELINE.write_text(json.dumps(report, indent=1))
+        print('baseline saved to', BASELINE)
+    sys.exit(1 if regressed and args.fail_on_regression else 0)
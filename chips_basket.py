@@ -0,0 +1,73 @@
+# Basket engine: sparse transaction x item incidence and pairwise association rules
+
+# chips_basket.py
+# Used by 005_basket-cross-sell-analysis.py:
+#   X, txns, items = incidence(merged, 'category')
+#   rules = association_rules(X, items, min_support=0.001, top_k=10)
+#   co = cooccurrence_with(X, items, flagged_baskets(merged, txns))
+#
+# The incidence matrix is built once from the basket lines (no dense pivot);
+# all pairwise co-occurrence counts come from one sparse product X.T @ X.
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def incidence(lines, item_col, tx_col='transaction_id'):
+    """Binary CSR matrix (transactions x items) plus the transaction and item labels.
+
+    Lines with a missing transaction id or item are ignored; repeated lines
+    of the same item in a basket count once.
+    """
+    tx_codes, txns = pd.factorize(lines[tx_col], sort=True)
+    item_codes, items = pd.factorize(lines[item_col], sort=True)
+    ok = (tx_codes >= 0) & (item_codes >= 0)
+    X = sparse.csr_matrix(
+        (np.ones(ok.sum(), dtype=np.int32), (tx_codes[ok], item_codes[ok])),
+        shape=(len(txns), len(items))
+    )
+    X.data[:] = 1  # duplicates were summed on construction
+    return X, pd.Index(txns, name=tx_col), pd.Index(items, name=item_col)
+
+
+def flagged_baskets(lines, txns, flag_col='is_chips', tx_col='transaction_id'):
+    """Boolean vector over `txns`: baskets with at least one flagged line."""
+    flagged = lines.loc[lines[flag_col].astype(bool), tx_col].unique()
+    return txns.isin(flagged)
+
+
+def cooccurrence_with(X, items, baskets, name='transaction_id'):
+    """Distinct baskets among `baskets` (boolean over rows of X) containing each item.
+
+    Items that never occur in those baskets are left out.
+    """
+    counts = np.asarray(X[np.flatnonzero(baskets)].sum(axis=0)).ravel()
+    co = pd.Series(counts, index=items, name=name)
+    return co[co > 0].sort_values(ascending=False)
+
+
+def association_rules(X, items, min_support=0.0, min_confidence=0.0, top_k=None):
+    """Pairwise rules antecedent -> consequent with support, confidence and lift.
+
+    min_support is a fraction of all baskets; top_k keeps the k highest-lift
+    consequents per antecedent.
+    """
+    n_tx = X.shape[0]
+    Xc = X.tocsc().astype(np.int64)
+    item_n = np.asarray(Xc.sum(axis=0)).ravel()
+    C = (Xc.T @ Xc).tocoo()
+    off = (C.row != C.col) & (C.data >= min_support * n_tx)
+    a, b, n_ab = C.row[off], C.col[off], C.data[off]
+    rules = pd.DataFrame({
+        'antecedent': items[a],
+        'consequent': items[b],
+        'baskets': n_ab,
+        'support': n_ab / n_tx,
+        'confidence': n_ab / item_n[a],
+        'lift': n_ab * n_tx / (item_n[a] * item_n[b])
+    })
+    rules = rules[rules['confidence'] >= min_confidence]
+    rules = rules.sort_values(['antecedent', 'lift', 'confidence'], ascending=[True, False, False])
+    if top_k is not None:
+        rules = rules.groupby('antecedent', sort=False).head(top_k)
+    return rules.reset_index(drop=True)
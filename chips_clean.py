@@ -0,0 +1,257 @@
+# Transaction cleaning & validation helpers, incl. a bounded-memory streaming mode
+
+# chips_clean.py
+# Used by 001_chips_analysis_start.py (and 007 for the QVI rule set). The checks
+# are declarative rules (qvi_rules.py) evaluated in one vectorized pass into a
+# per-row bitmask: tx_rules for the 001 schema, qvi_chips_rules for the QVI
+# chips table. Each removing rule can drop or quarantine its rows (actions=).
+# The streaming path reads transactions.csv in chunks, evaluates the same rules
+# per chunk, deduplicates (transaction_id, sku) across chunks with a set of
+# 64-bit key hashes, takes the 99th percentiles from a mergeable quantile
+# sketch and appends cleaned rows to the output CSVs as it goes. Its report has
+# the same keys and values as the in-memory path, per-rule table included (the
+# outlier rule is counted over the kept rows in both).
+import numpy as np
+import pandas as pd
+from qvi_rules import Rule, duplicate, evaluate, is_true, normalized, not_null, numeric, outlier, positive, required
+
+REQUIRED_TX = ['transaction_id','customer_id','sku','quantity','price','transaction_date','store_id','category','subcategory']
+DEDUP_KEYS = ['transaction_id','sku']
+OUTLIER_MULTIPLE = 5
+
+
+def chips_rule(action='flag'):
+    # adjust condition to your schema
+    return Rule('not_chips', ['category','subcategory'], lambda v: ~(
+        (v.lower('category') == 'chips') | v.lower('subcategory').str.contains('chip|crisps')
+    ), action)
+
+
+def outlier_rule(action='flag'):
+    # extremely large quantity or price: above OUTLIER_MULTIPLE x the 99th percentile of the kept rows
+    return outlier(['quantity','price'], q=0.99, multiple=OUTLIER_MULTIPLE, action=action)
+
+
+def tx_rules(seen=None, outliers=True):
+    """Validation rules of the 001 transaction table, in order.
+
+    Nulls are counted, duplicates and non-numeric or zero/negative quantity and
+    price are removed, chips rows and outliers are flagged. `seen` carries the
+    duplicate keys across streaming chunks (KeySet).
+    """
+    return [required(REQUIRED_TX), not_null(REQUIRED_TX),
+            duplicate(DEDUP_KEYS, seen=seen),
+            numeric('quantity'), numeric('price'), positive('quantity'), positive('price'),
+            chips_rule()] + ([outlier_rule()] if outliers else [])
+
+
+def qvi_chips_rules():
+    """Rules keeping the clean chips rows of the merged QVI table (007)."""
+    return [is_true('is_chips', 'not_chips'),
+            numeric('quantity'), positive('quantity'), numeric('price'), positive('price'),
+            not_null(['transaction_id','customer_id'], action='drop')]
+
+
+def customer_rules():
+    # Normalize key attributes; remove duplicates on customer_id
+    return [normalized('postal_code', lambda s: s.astype(str).str.strip()),
+            duplicate(['customer_id'], name='duplicate_customer')]
+
+
+def chips_mask(tx):
+    return ~evaluate(tx, [chips_rule()]).failed('not_chips')
+
+
+def clean_customers(cust, actions=None):
+    clean, _ = evaluate(cust, customer_rules(), actions).split(cust)
+    return clean
+
+
+def rule_report(res):
+    """Report values of one tx_rules evaluation; the counts add up over streaming chunks."""
+    unique, keep = ~res.failed('duplicate'), res.keep
+    report = {
+        'missing_columns': res.missing,
+        'tx_nulls': {c: res.count(f'null:{c}') for c in REQUIRED_TX if f'null:{c}' not in res.skipped},
+        'duplicates': res.count('duplicate'),
+        'bad_qty': res.count('non_positive:quantity', unique),
+        'bad_price': res.count('non_positive:price', unique),
+        'clean_rows': int(keep.sum()),
+        'chips_rows': int((keep & ~res.failed('not_chips')).sum()),
+        'quarantined': int(res.quarantined.sum()),
+        'removed': res.removed(),
+        'rule_counts': res.counts().set_index(['rule','action'])
+    }
+    if 'outlier' in res.thresholds:
+        report['qty_q99'], report['price_q99'] = res.thresholds['outlier']['quantity'], res.thresholds['outlier']['price']
+        report['outliers'] = res.count('outlier', keep)
+    return report
+
+
+def print_report(report):
+    print('tx shape:', report['tx_shape'])
+    for c in report['missing_columns']:
+        print(f'WARNING: {c} missing from transactions')
+    print('tx nulls:\n', pd.Series(report['tx_nulls'], dtype='int64'))
+    print('duplicate rows dropped:', report['duplicates'])
+    print('bad_qty rows:', report['bad_qty'])
+    print('bad_price rows:', report['bad_price'])
+    print('99th pct quantity, price:', report['qty_q99'], report['price_q99'])
+    print('Potential extreme outliers:', report['outliers'])
+    print('clean tx rows:', report['clean_rows'], 'chips rows:', report['chips_rows'])
+    print('quarantined rows:', report['quarantined'])
+    print('merged null customer count:', report['merged_null_customer'])
+    print('rule counts:\n', report['rule_counts'])
+
+
+class KeySet:
+    """Compact set of row keys, stored as sorted uint64 hashes (8 bytes per key)."""
+
+    def __init__(self):
+        self.main = np.empty(0, dtype=np.uint64)
+        self.pending = []
+
+    def _contains(self, h):
+        found = np.zeros(len(h), dtype=bool)
+        for arr in [self.main] + self.pending:
+            if len(arr):
+                pos = np.minimum(np.searchsorted(arr, h), len(arr) - 1)
+                found |= arr[pos] == h
+        return found
+
+    def add_new(self, df, cols):
+        """Return a mask of rows whose key is new (first occurrence) and remember them."""
+        h = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+        first = ~pd.Series(h).duplicated().to_numpy()
+        new = first & ~self._contains(h)
+        if new.any():
+            self.pending.append(np.sort(h[new]))
+            # merge the small sorted runs into the main array once they add up
+            if sum(len(a) for a in self.pending) * 4 > len(self.main):
+                self.main = np.sort(np.concatenate([self.main] + self.pending))
+                self.pending = []
+        return new
+
+
+class QuantileSketch:
+    """Mergeable value-count summary for streaming quantiles.
+
+    Holds exact (value, count) pairs while there are at most `max_bins`
+    distinct values (quantities, shelf prices), which makes quantile() equal
+    to pandas' linear interpolation. Past that it compresses neighbouring
+    values into weighted centroids so memory stays bounded.
+    """
+
+    def __init__(self, max_bins=100_000):
+        self.max_bins = max_bins
+        self.values = np.empty(0)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.exact = True
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float)
+        x = x[~np.isnan(x)]
+        if not len(x):
+            return
+        v, c = np.unique(x, return_counts=True)
+        v = np.concatenate([self.values, v])
+        c = np.concatenate([self.counts, c])
+        order = np.argsort(v, kind='stable')
+        v, c = v[order], c[order]
+        uniq, start = np.unique(v, return_index=True)
+        self.values, self.counts = uniq, np.add.reduceat(c, start)
+        if len(self.values) > self.max_bins:
+            self._compress()
+
+    def _compress(self):
+        cum = np.cumsum(self.counts)
+        bins = np.minimum((cum - 1) * (self.max_bins // 2) // cum[-1], self.max_bins // 2 - 1)
+        start = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        counts = np.add.reduceat(self.counts, start)
+        self.values = np.add.reduceat(self.values * self.counts, start) / counts
+        self.counts = counts
+        self.exact = False
+
+    def _value_at(self, rank):
+        return self.values[np.searchsorted(np.cumsum(self.counts), rank, side='right')]
+
+    def quantile(self, q):
+        n = self.counts.sum()
+        if n == 0:
+            return np.nan
+        h = (n - 1) * q
+        lo = int(np.floor(h))
+        a, b = self._value_at(lo), self._value_at(min(lo + 1, n - 1))
+        t = h - lo
+        # same interpolation formula as numpy/pandas linear quantiles
+        return b - (b - a) * (1 - t) if t >= 0.5 else a + (b - a) * t
+
+
+def _add_counts(total, part):
+    # sum the additive report values of one chunk into the running report
+    for k in ('duplicates', 'bad_qty', 'bad_price', 'clean_rows', 'chips_rows', 'quarantined'):
+        total[k] += part[k]
+    for k in ('tx_nulls', 'removed'):
+        for c, n in part[k].items():
+            total[k][c] = total[k].get(c, 0) + n
+    total['rule_counts'] = part['rule_counts'] if total['rule_counts'] is None else total['rule_counts'] + part['rule_counts']
+
+
+def stream_clean_transactions(tx_path, cust, tx_out, merged_out, chunksize=500_000, actions=None, quarantine_out=None):
+    """Clean transactions.csv chunk by chunk; returns the validation report.
+
+    `cust` must already be cleaned (clean_customers). Peak memory is one chunk
+    plus the customer table, the key-hash set and two bounded sketches. Rows of
+    rules set to 'quarantine' are appended to `quarantine_out` (CSV) if given;
+    outliers are only counted here, since their thresholds need the whole file.
+    """
+    keys = KeySet()
+    rules = tx_rules(seen=keys, outliers=False)
+    qty_sketch, price_sketch = QuantileSketch(), QuantileSketch()
+    report = dict(tx_rows=0, duplicates=0, bad_qty=0, bad_price=0, clean_rows=0, chips_rows=0, quarantined=0,
+                  merged_null_customer=0, missing_columns=[], tx_nulls={}, removed={}, rule_counts=None)
+    n_cols = 0
+    first, first_quarantine = True, True
+    # key columns are read as text so a key hashes the same in every chunk
+    reader = pd.read_csv(tx_path, parse_dates=['transaction_date'], dayfirst=False, chunksize=chunksize,
+                         dtype={k: str for k in DEDUP_KEYS})
+    for tx in reader:
+        res = evaluate(tx, rules, actions)
+        if first:
+            n_cols = tx.shape[1]
+            report['missing_columns'] = res.missing
+        report['tx_rows'] += len(tx)
+        _add_counts(report, rule_report(res))
+        tx, quarantine = res.split(tx)
+        if quarantine_out is not None and len(quarantine):
+            quarantine.to_csv(quarantine_out, mode='w' if first_quarantine else 'a', header=first_quarantine, index=False)
+            first_quarantine = False
+
+        tx['line_total'] = tx['quantity'] * tx['price']
+        tx['is_chips'] = ~res.failed('not_chips')[res.keep]
+        qty_sketch.update(tx['quantity'])
+        price_sketch.update(tx['price'])
+
+        merged = tx.merge(cust, how='left', on='customer_id', suffixes=('','_cust'))
+        report['merged_null_customer'] += int(merged['customer_id'].isnull().sum())
+
+        tx.to_csv(tx_out, mode='w' if first else 'a', header=first, index=False)
+        merged.to_csv(merged_out, mode='w' if first else 'a', header=first, index=False)
+        first = False
+
+    report['tx_shape'] = (report['tx_rows'], n_cols)
+    report['qty_q99'] = qty_sketch.quantile(0.99)
+    report['price_q99'] = price_sketch.quantile(0.99)
+    report['quantile_exact'] = qty_sketch.exact and price_sketch.exact
+
+    # flagging extremes needs both thresholds, so count them in a second
+    # projected pass over the (already cleaned) output
+    rule = outlier_rule()
+    thresholds = {rule.name: {'quantity': report['qty_q99'], 'price': report['price_q99']}}
+    outliers = 0
+    for part in pd.read_csv(tx_out, usecols=['quantity','price'], chunksize=chunksize):
+        outliers += evaluate(part, [rule], thresholds=thresholds).count(rule.name)
+    report['outliers'] = outliers
+    report['rule_counts'].loc[(rule.name, rule.action), :] = [outliers, 0, outliers]
+    report['rule_counts'] = report['rule_counts'].astype('int64')
+    return report
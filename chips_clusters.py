@@ -0,0 +1,120 @@
+# k selection for customer clustering: parallel sweep, sampled silhouette, mini-batch k-means
+
+# chips_clusters.py
+# Used by 004_customer_segmentation-k-means.py:
+#   cust_feat, Xs = features_for_table('tx_cust_merged')   # rebuilt only when the table changes
+#   km, scores = select_k(Xs, ks=range(2, 7))
+#   cust_feat['cluster'] = km.labels_
+#
+# Every k is fitted once, in parallel; the winning model is returned as-is
+# (no refit). Silhouette is exact up to `sample_size` rows; above that it is
+# the mean over `n_rounds` cluster-stratified samples, with a standard error.
+# The customer features and their scaled matrix are saved under CACHE_DIR with
+# the source table's size and mtime (as chips_cube.SalesCube.for_table does), so
+# rerunning the sweep on an unchanged table reads neither the lines nor the
+# features again, and a changed table can never reuse a stale matrix.
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from qvi_schema import read_table, resolve
+
+FEATURES = ['frequency','monetary','avg_units_per_tx']
+MINIBATCH_ABOVE = 200_000   # switch to MiniBatchKMeans above this many rows
+CACHE_DIR = Path('.cache')
+FEATURES_VERSION = 1   # bump when customer_features / scaled_features change
+
+
+def customer_features(chips):
+    cust_feat = chips.groupby('customer_id').agg({
+        'transaction_id': 'nunique',
+        'line_total': 'sum',
+        'quantity': 'sum'
+    }).rename(columns={'transaction_id':'frequency','line_total':'monetary','quantity':'units'})
+    cust_feat['avg_units_per_tx'] = cust_feat['units'] / cust_feat['frequency']
+    return cust_feat
+
+
+def scaled_features(cust_feat, features=FEATURES):
+    X = np.log1p(cust_feat[features].fillna(0))
+    return StandardScaler().fit_transform(X)
+
+
+def features_for_table(name, features=FEATURES, cache_dir=CACHE_DIR):
+    """(cust_feat, scaled matrix) of the chips rows of artifact `name`, rebuilt only when the source file changes."""
+    src = resolve(name)
+    st = src.stat()
+    meta = {'version': FEATURES_VERSION, 'source': str(src), 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns, 'features': list(features)}
+    out_dir = Path(cache_dir) / f'features-{Path(name).name}'
+    meta_file = out_dir / 'meta.json'
+    if meta_file.exists() and json.loads(meta_file.read_text()) == meta:
+        return pd.read_parquet(out_dir / 'customer_features.parquet'), np.load(out_dir / 'scaled.npy')
+    chips = read_table(name, columns=['customer_id', 'transaction_id', 'quantity', 'line_total', 'is_chips'])
+    if 'is_chips' in chips.columns:
+        chips = chips[chips['is_chips']]
+    cust_feat = customer_features(chips)
+    Xs = scaled_features(cust_feat, features)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cust_feat.to_parquet(out_dir / 'customer_features.parquet')
+    np.save(out_dir / 'scaled.npy', Xs)
+    meta_file.write_text(json.dumps(meta))
+    return cust_feat, Xs
+
+
+def stratified_sample(labels, size, rng):
+    """Row indices sampling each cluster in proportion to its size (at least 2 rows each)."""
+    idx = []
+    n = len(labels)
+    for lab in np.unique(labels):
+        members = np.flatnonzero(labels == lab)
+        take = min(len(members), max(2, int(round(size * len(members) / n))))
+        idx.append(rng.choice(members, size=take, replace=False))
+    return np.concatenate(idx)
+
+
+def sampled_silhouette(X, labels, sample_size=20_000, n_rounds=5, random_state=42):
+    """Silhouette score and its standard error (0.0 when computed on all rows)."""
+    if len(X) <= sample_size:
+        return silhouette_score(X, labels), 0.0
+    rng = np.random.default_rng(random_state)
+    scores = []
+    for _ in range(n_rounds):
+        idx = stratified_sample(labels, sample_size, rng)
+        scores.append(silhouette_score(X[idx], labels[idx]))
+    return float(np.mean(scores)), float(np.std(scores, ddof=1) / np.sqrt(n_rounds))
+
+
+def fit_k(X, k, minibatch=False, random_state=42, sample_size=20_000, n_rounds=5):
+    if minibatch:
+        km = MiniBatchKMeans(n_clusters=k, random_state=random_state, batch_size=4096).fit(X)
+    else:
+        km = KMeans(n_clusters=k, random_state=random_state).fit(X)
+    score, se = sampled_silhouette(X, km.labels_, sample_size, n_rounds, random_state)
+    return km, score, se
+
+
+def select_k(X, ks=range(2, 7), n_jobs=-1, minibatch=None, random_state=42, sample_size=20_000, n_rounds=5):
+    """Fit every k in parallel and return (best fitted model, per-k score table).
+
+    `score_ci95` is the half-width of a normal 95% interval on the silhouette
+    estimate; it is 0 when the score was computed on every row.
+    """
+    X = np.asarray(X)
+    if minibatch is None:
+        minibatch = len(X) > MINIBATCH_ABOVE
+    fits = Parallel(n_jobs=n_jobs)(
+        delayed(fit_k)(X, k, minibatch, random_state, sample_size, n_rounds) for k in ks
+    )
+    scores = pd.DataFrame({
+        'k': list(ks),
+        'silhouette': [f[1] for f in fits],
+        'score_ci95': [1.96 * f[2] for f in fits],
+        'inertia': [f[0].inertia_ for f in fits]
+    })
+    best = int(scores['silhouette'].values.argmax())
+    return fits[best][0], scores
@@ -0,0 +1,242 @@
+# Pre-aggregated chips sales cube: store x day x sku cells that every report rolls up
+
+# chips_cube.py
+# Usage:
+#   cube = SalesCube.for_table('tx_chips_clean')       # built once per source file, then loaded
+#   pack = cube.rollup(['pack_size'], ['quantity', 'line_total', 'transactions'])   # transactions: from the line table
+#   daily = cube.rollup(['store_id', 'date'], ['line_total', 'quantity', 'transactions', 'customers'])
+#   cube.append(new_day_rows).save(cube_dir)          # incremental: whole days, replacing any already held
+#
+# Chips lines are grouped once into cells keyed by store, day, sku and the
+# product / customer-segment attributes present (brand_guess, pack_size,
+# packet_size, lifestage, premium_customer), holding the additive measures
+# (units, revenue, line count) and the cell's distinct transaction and customer
+# counts. Those counts add up exactly only while a roll-up keeps store, day and
+# sku (a transaction has one store, day and customer, but may hold several
+# skus). Distinct counts by store and/or day come from the baskets cuboid (one
+# row per transaction, which also serves the basket-value views); any other
+# grain, e.g. transactions by pack_size, is counted from the source line table,
+# reading only the key columns. The cube is no smaller than the data: store x
+# day x sku is sparse, so on QVI-shaped data cells and baskets each have about
+# as many rows as there are chips lines. What it saves is the line-table scans:
+# it is built once per source file, and a loaded cube reads only the cuboid
+# columns a roll-up needs. Rolled-up sums may differ from a line-level groupby
+# in the last float digit (summation order).
+import json
+from pathlib import Path
+import pandas as pd
+from qvi_schema import apply_schema, columns_of, read_table, resolve
+
+CACHE_DIR = Path('.cache')
+CUBE_VERSION = 3   # bump when the cuboid layout or contents change
+ATTRIBUTES = ['brand_guess', 'pack_size', 'packet_size', 'lifestage', 'premium_customer']
+ADDITIVE = ['quantity', 'line_total', 'lines']
+DISTINCT = {'transactions': 'transaction_id', 'customers': 'customer_id'}   # measure -> counted key
+CELL_KEYS = ['store_id', 'date', 'sku']
+LINE_COLUMNS = ['store_id', 'sku', 'transaction_id', 'customer_id', 'quantity', 'line_total'] + ATTRIBUTES
+
+
+def _cells(frame, attrs):
+    keys = ['store_id', 'date'] + [c for c in ['sku'] if c in frame.columns] + attrs
+    return frame.groupby(keys, observed=True, dropna=False).agg(
+        quantity=('quantity', 'sum'),
+        line_total=('line_total', 'sum'),
+        lines=('line_total', 'size'),
+        transactions=('transaction_id', 'nunique'),
+        customers=('customer_id', 'nunique')
+    ).reset_index()
+
+
+def _baskets(frame):
+    # keyed by customer too, so distinct customer counts stay exact if a transaction id is reused;
+    # dropna=False keeps baskets without a customer (001 keeps unmatched rows in tx_cust_merged)
+    return frame.groupby(['store_id', 'date', 'transaction_id', 'customer_id'], observed=True, dropna=False).agg(
+        line_total=('line_total', 'sum'),
+        quantity=('quantity', 'sum')
+    ).reset_index()
+
+
+def cube_dir_for(name):
+    return CACHE_DIR / f'cube-{Path(name).name}'
+
+
+def _source_meta(path, date_col):
+    st = Path(path).stat()
+    return {'version': CUBE_VERSION, 'source': str(path), 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns, 'date_col': date_col}
+
+
+def write_meta(cube_dir, source=None, date_col='date'):
+    """Record what the cuboids in `cube_dir` were built from (for_table reuses them while it is unchanged)."""
+    meta = _source_meta(source, date_col) if source else {'version': CUBE_VERSION}
+    for old in Path(cube_dir).glob('keys-*.parquet'):
+        old.unlink()   # distinct-key cuboids of cube version 2
+    (Path(cube_dir) / 'meta.json').write_text(json.dumps(meta))
+    return meta
+
+
+class SalesCube:
+    """Store x day x sku chips sales cells plus the baskets cuboid.
+
+    Built in memory (build) or loaded from a cube directory (load/for_table), in
+    which case the cuboids are read from Parquet column by column as roll-ups
+    need them and in full only when `cells` / `baskets` are used directly.
+    """
+
+    def __init__(self, cells=None, baskets=None, cube_dir=None, meta=None):
+        self._cells = apply_schema(cells) if cells is not None else None
+        self._baskets = apply_schema(baskets) if baskets is not None else None
+        self.cube_dir = Path(cube_dir) if cube_dir else None
+        self.meta = meta or {}
+        cols = self._cells.columns if self._cells is not None else columns_of(self.cube_dir / 'cells.parquet')
+        self.attributes = [c for c in ATTRIBUTES if c in cols]
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            self._cells = read_table(self.cube_dir / 'cells.parquet')
+        return self._cells
+
+    @property
+    def baskets(self):
+        if self._baskets is None:
+            self._baskets = read_table(self.cube_dir / 'baskets.parquet')
+        return self._baskets
+
+    def _columns(self, cuboid, cols):
+        frame = getattr(self, '_' + cuboid)
+        cols = list(dict.fromkeys(cols))
+        return frame[cols] if frame is not None else read_table(self.cube_dir / f'{cuboid}.parquet', columns=cols)
+
+    def _source_lines(self, cols):
+        # distinct keys at a grain the cuboids cannot count exactly, read from the line table
+        source, date_col = self.meta.get('source'), self.meta.get('date_col', 'date')
+        if source is None:
+            raise ValueError('distinct counts at this grain need the line table; '
+                             'use SalesCube.for_table or save the cube with source=')
+        if _source_meta(source, date_col) != self.meta:
+            raise ValueError(f'{source} changed since the cube was built; rebuild it (SalesCube.for_table)')
+        read = list(dict.fromkeys(date_col if c == 'date' else c for c in cols))
+        lines = read_table(source, columns=read + ['is_chips'])
+        if 'is_chips' in lines.columns:
+            lines = lines[lines['is_chips']]
+        if 'date' in cols:
+            lines = lines.assign(date=lines[date_col].dt.normalize())
+        return lines
+
+    @classmethod
+    def build(cls, lines, date_col='date'):
+        """Aggregate chips lines (one load of the line table, no per-report rescans)."""
+        attrs = [c for c in ATTRIBUTES if c in lines.columns]
+        cols = {c: lines[c] for c in LINE_COLUMNS if c in lines.columns}
+        cols['date'] = lines[date_col].dt.normalize()
+        frame = pd.DataFrame(cols)
+        return cls(_cells(frame, attrs), _baskets(frame))
+
+    @classmethod
+    def for_table(cls, name, date_col='date', cube_dir=None):
+        """Cube of the chips rows of artifact `name`, rebuilt only when the source file changes."""
+        src = resolve(name)
+        cube_dir = Path(cube_dir) if cube_dir else cube_dir_for(name)
+        meta = _source_meta(src, date_col)
+        meta_file = cube_dir / 'meta.json'
+        if meta_file.exists() and json.loads(meta_file.read_text()) == meta:
+            return cls.load(cube_dir)
+        lines = read_table(name, columns=[date_col, 'is_chips'] + LINE_COLUMNS)
+        if 'is_chips' in lines.columns:
+            lines = lines[lines['is_chips']]
+        cube = cls.build(lines, date_col)
+        return cube.save(cube_dir, src, date_col)
+
+    def append(self, lines, date_col='date'):
+        """Fold in whole days of new chips lines; days already in the cube are replaced."""
+        new = SalesCube.build(lines, date_col)
+        days = new.cells['date'].unique()
+
+        def merge(old, add, keys):
+            both = pd.concat([old[~old['date'].isin(days)], add], ignore_index=True)
+            for c in both.columns:
+                if isinstance(old[c].dtype, pd.CategoricalDtype):
+                    both[c] = both[c].astype(object)   # categories differ between batches
+            return apply_schema(both).sort_values(keys, ignore_index=True)
+
+        keys = [c for c in CELL_KEYS if c in self.cells.columns] + self.attributes
+        self._cells = merge(self.cells, new.cells, keys)
+        self._baskets = merge(self.baskets, new.baskets, ['store_id', 'date', 'transaction_id', 'customer_id'])
+        self.meta = {}   # no longer the roll-up of one source file
+        return self
+
+    def rollup(self, by, measures=ADDITIVE, dropna=True):
+        """Sum `measures` by the columns `by` (groups with a null key are dropped, as in groupby).
+
+        Distinct measures are summed from the cells when `by` keeps store_id, date
+        and sku, counted in the baskets when `by` is within store_id/date, and
+        otherwise counted in the source line table (see _source_lines).
+        """
+        by, measures = list(by), list(measures)
+        cell_grain = set(CELL_KEYS) <= set(by)
+        summed = [m for m in measures if m in ADDITIVE or (m in DISTINCT and cell_grain)]
+        counted = [m for m in measures if m in DISTINCT and not cell_grain]
+        parts = []
+        if summed:
+            parts.append(self._columns('cells', by + summed).groupby(by, observed=True, dropna=dropna)[summed].sum())
+        if counted:
+            cols = by + [DISTINCT[m] for m in counted]
+            if set(by) <= {'store_id', 'date'}:
+                table = self._columns('baskets', cols)
+            else:
+                table = self._source_lines(cols)
+            g = table.groupby(by, observed=True, dropna=dropna)
+            parts.append(pd.DataFrame({m: g[DISTINCT[m]].nunique() for m in counted}))
+        out = parts[0] if len(parts) == 1 else parts[0].join(parts[1], how='outer')
+        return out[measures].reset_index()
+
+    def save(self, cube_dir, source=None, date_col='date'):
+        """Write the cuboids; `source` (the line table) lets for_table reuse the cube."""
+        cube_dir = Path(cube_dir)
+        cube_dir.mkdir(parents=True, exist_ok=True)
+        self.cells.to_parquet(cube_dir / 'cells.parquet', index=False)
+        self.baskets.to_parquet(cube_dir / 'baskets.parquet', index=False)
+        self.meta = write_meta(cube_dir, source, date_col)
+        return self
+
+    @classmethod
+    def load(cls, cube_dir):
+        """Cube saved in `cube_dir`; its cuboids are read on demand."""
+        meta_file = Path(cube_dir) / 'meta.json'
+        return cls(cube_dir=cube_dir, meta=json.loads(meta_file.read_text()) if meta_file.exists() else None)
+
+    def verify(self, lines, date_col='date', rtol=1e-9):
+        """Assert that the roll-ups match direct groupbys of the chips `lines` the cube was built from.
+
+        Checks revenue, units, distinct transactions and customers by store x day
+        (baskets) and by store x day x sku (cells), and the per-transaction basket
+        values; raises AssertionError on a mismatch.
+        """
+        import numpy as np
+        frame = lines.assign(date=lines[date_col].dt.normalize())
+        measures = ['line_total', 'quantity', 'transactions', 'customers']
+        for by in (['store_id', 'date'], CELL_KEYS):
+            direct = frame.groupby(by, observed=True).agg(
+                line_total=('line_total', 'sum'), quantity=('quantity', 'sum'),
+                transactions=('transaction_id', 'nunique'), customers=('customer_id', 'nunique')).reset_index()
+            cube = self.rollup(by, measures)
+            for f in (direct, cube):
+                for c in set(by) & {'store_id', 'sku'}:
+                    f[c] = f[c].astype(str)   # categorical in the cube
+            assert len(cube) == len(direct), f'cube has {len(cube)} groups by {by}, lines have {len(direct)}'
+            both = direct.merge(cube, on=by, how='left', suffixes=('', '_cube'))
+            for c in measures:
+                np.testing.assert_allclose(both[c + '_cube'].to_numpy(float), both[c].to_numpy(float), rtol=rtol,
+                                           err_msg=f'cube {c} by {by}')
+        baskets = self.baskets.groupby('transaction_id')['line_total'].sum().sort_index()
+        expect = frame.groupby('transaction_id')['line_total'].sum().sort_index()
+        assert len(baskets) == len(expect), f'cube has {len(baskets)} baskets, lines have {len(expect)}'
+        np.testing.assert_allclose(baskets.to_numpy(), expect.to_numpy(), rtol=rtol, err_msg='cube basket values')
+        return self
+
+    def store_daily(self):
+        """Store x day panel in the layout 011_trial_analysis.py uses."""
+        daily = self.rollup(['store_id', 'date'], ['line_total', 'quantity', 'transactions', 'customers'])
+        return daily.rename(columns={'line_total': 'daily_revenue', 'quantity': 'daily_units',
+                                     'transactions': 'daily_txns', 'customers': 'daily_customers'})
@@ -0,0 +1,126 @@
+# Lazy out-of-core backend for the chips prep (DuckDB over Parquet)
+
+# chips_lazy.py
+# Used by 007_chips_data_prep.py (BACKEND = 'duckdb'):
+#   tx_parquet = transactions_parquet(TXN_XLSX, 'in', CACHE_DIR)
+#   products = update_product_lookup(lookup, distinct_values(tx_parquet, 'product_description'))
+#   res = prep_chips(tx_parquet, cust, products, OUT_DIR / 'tx_chips_clean')   # + its cube under .cache
+#
+# The pandas path materializes every transaction, joins the products, merges
+# the customers into the full table and only then keeps the chips rows. Here
+# the same steps are one query plan: the chips / quantity / price / key filters
+# are applied next to the Parquet scan (DuckDB pushes them into the reader), so
+# only chips lines reach the customer join, and the result is streamed straight
+# to Parquet/CSV. The sales cube cuboids (chips_cube.py) are then computed in
+# SQL over the (much smaller) output file and copied straight to Parquet, from
+# which roll-ups read only the columns they need; of the aggregates only the RFM
+# state comes back to pandas whole. Column and row order match the pandas path.
+from pathlib import Path
+from chips_cube import ATTRIBUTES, SalesCube, cube_dir_for, write_meta
+from chips_rfm import MONEY_DP
+
+
+def connect(memory_limit=None, threads=None):
+    """In-process DuckDB connection (duckdb is only needed for this backend)."""
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("BACKEND = 'duckdb' needs the duckdb package (pip install duckdb)") from e
+    con = duckdb.connect()
+    if memory_limit:
+        con.execute(f"SET memory_limit = '{memory_limit}'")
+    if threads:
+        con.execute(f'SET threads = {int(threads)}')
+    return con
+
+
+def _lit(path):
+    # path as a SQL string literal
+    return "'" + str(path).replace("'", "''") + "'"
+
+
+def distinct_values(parquet, col, con=None):
+    """Distinct non-null values of one column of a Parquet file (reads that column only)."""
+    con = con or connect()
+    return con.execute(f'SELECT DISTINCT "{col}" FROM read_parquet({_lit(parquet)}) '
+                       f'WHERE "{col}" IS NOT NULL').df()[col]
+
+
+def prep_chips(tx_parquet, cust, products, out_name, csv_copy=True, cube_dir=None, con=None):
+    """Filter, join and save the clean chips lines; return the small reporting frames.
+
+    `cust` is the normalized customer table and `products` the product lookup
+    (indexed by description). Writes <out_name>.parquet (and .csv) and its cube
+    cuboids to `cube_dir` (chips_cube.cube_dir_for(out_name) by default). Returns
+    a dict with the RFM state and quantity pairs (chips_rfm.rfm_state layout) and
+    the chips_cube.SalesCube of the output, loaded on demand from `cube_dir`.
+    """
+    con = con or connect()
+    out = Path(out_name).with_suffix('.parquet')
+    cube_dir = Path(cube_dir) if cube_dir else cube_dir_for(out_name)
+    con.register('cust', cust)
+    con.register('products', products.reset_index())
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW chips AS
+        SELECT t.* EXCLUDE (file_row_number),
+               t.line_total / t.quantity AS price,
+               p.pack_size, p.brand_guess,
+               c.* EXCLUDE (customer_id),
+               p.is_chips
+        FROM read_parquet({_lit(tx_parquet)}, file_row_number = true) t
+        JOIN products p ON t.product_description = p.product_description
+        LEFT JOIN cust c ON t.customer_id = c.customer_id
+        WHERE p.is_chips
+          AND t.quantity > 0 AND t.line_total / t.quantity > 0
+          AND t.transaction_id IS NOT NULL AND t.customer_id IS NOT NULL
+        ORDER BY t.file_row_number
+    """)
+    con.execute(f'COPY (SELECT * FROM chips) TO {_lit(out)} (FORMAT PARQUET)')
+    if csv_copy:
+        # QVI dates are whole days and booleans are True/False; write them as the pandas path does
+        types = con.execute(f'DESCRIBE SELECT * FROM read_parquet({_lit(out)})').fetchall()
+        bools = [f"CASE WHEN \"{c}\" THEN 'True' WHEN NOT \"{c}\" THEN 'False' END AS \"{c}\""
+                 for c, t, *_ in types if t == 'BOOLEAN']
+        cols = f"* REPLACE ({', '.join(bools)})" if bools else '*'
+        con.execute(f"COPY (SELECT {cols} FROM read_parquet({_lit(out)})) TO {_lit(out.with_suffix('.csv'))} "
+                    "(HEADER, TIMESTAMPFORMAT '%Y-%m-%d')")
+
+    # everything below reads the filtered output, not the raw transactions
+    src = f'read_parquet({_lit(out)})'
+    qty_type = con.execute(f'SELECT typeof(quantity) FROM {src} LIMIT 1').fetchone()
+    qty_type = qty_type[0] if qty_type else 'DOUBLE'   # keep integer quantities integer after sum()
+
+    # cuboids of chips_cube.SalesCube (the reporting aggregates are roll-ups of these), written as Parquet
+    cols = set(con.execute(f'SELECT * FROM {src} LIMIT 0').df().columns)
+    attrs = [c for c in ATTRIBUTES if c in cols]
+    day = "date_trunc('day', date) AS date"
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    con.execute(f"""
+        COPY (SELECT store_id, {day}, sku, {''.join(a + ', ' for a in attrs)}
+                     CAST(sum(quantity) AS {qty_type}) AS quantity, sum(line_total) AS line_total, count(*) AS lines,
+                     count(DISTINCT transaction_id) AS transactions, count(DISTINCT customer_id) AS customers
+              FROM {src} GROUP BY ALL ORDER BY ALL)
+        TO {_lit(cube_dir / 'cells.parquet')} (FORMAT PARQUET)
+    """)
+    con.execute(f"""
+        COPY (SELECT store_id, {day}, transaction_id, customer_id,
+                     sum(line_total) AS line_total, CAST(sum(quantity) AS {qty_type}) AS quantity
+              FROM {src} GROUP BY ALL ORDER BY ALL)
+        TO {_lit(cube_dir / 'baskets.parquet')} (FORMAT PARQUET)
+    """)
+    write_meta(cube_dir, out, 'date')
+
+    # same layout as chips_rfm.rfm_state (monetary rounded to cents, so the summation order does not matter)
+    rfm_state = con.execute(f"""
+        SELECT customer_id, max(date) AS last_date, count(DISTINCT transaction_id) AS frequency,
+               round(sum(line_total), {MONEY_DP}) AS monetary, CAST(sum(quantity) AS {qty_type}) AS units
+        FROM {src} GROUP BY customer_id ORDER BY customer_id
+    """).df().set_index('customer_id')
+    qty_pairs = con.execute(f"""
+        SELECT DISTINCT customer_id, quantity FROM {src} WHERE quantity IS NOT NULL ORDER BY customer_id, quantity
+    """).df()
+
+    con.unregister('cust')
+    con.unregister('products')
+    return {'rfm_state': rfm_state, 'qty_pairs': qty_pairs, 'cube': SalesCube.load(cube_dir)}
@@ -0,0 +1,108 @@
+# Incremental RFM: compact per-customer state folded from daily batches
+
+# chips_rfm.py
+# Usage:
+#   store = RFMStore.load(RFM_STATE_DIR)     # empty store on first run
+#   store.fold(new_chips_rows)                # e.g. one day of tx_chips_clean rows
+#   store.save(RFM_STATE_DIR)
+#   rfm = score_rfm(store.rfm())             # same columns as chips_customers_rfm.csv
+#   store.verify(batch_rfm)                   # folded scores == the batch chips_customers_rfm.csv
+#
+# State per customer is last purchase date, distinct transactions, spend and
+# units, so scores are recomputed without rereading history. Batches must not
+# split a transaction (daily batches never do), since distinct transaction
+# counts of different batches are added. Spend is kept rounded to cents, so the
+# order its float lines were added in (backend, batch split) cannot change it,
+# nor the score ties it decides.
+from pathlib import Path
+import pandas as pd
+
+STATE_COLS = ['last_date', 'frequency', 'monetary', 'units']
+MONEY_DP = 2   # decimal places of monetary in the state (QVI amounts are in cents)
+
+
+def rfm_state(chips, date_col='date'):
+    """Vectorized per-customer state for a batch of chips rows (no Python lambdas)."""
+    state = chips.groupby('customer_id').agg(
+        last_date=(date_col, 'max'),
+        frequency=('transaction_id', 'nunique'),
+        monetary=('line_total', 'sum'),
+        units=('quantity', 'sum')
+    )
+    state['monetary'] = state['monetary'].round(MONEY_DP)
+    # avg_units_per_tx in chips_customers_rfm.csv divides units by the number of
+    # distinct quantity values, so keep those (customer, quantity) pairs as well
+    qty_pairs = chips[['customer_id', 'quantity']].dropna().drop_duplicates()
+    return state, qty_pairs
+
+
+def rfm_table(state, qty_pairs, snapshot_date=None):
+    """Recency/frequency/monetary frame in the layout of chips_customers_rfm.csv."""
+    if snapshot_date is None:
+        snapshot_date = state['last_date'].max() + pd.Timedelta(days=1)
+    distinct_qty = qty_pairs.groupby('customer_id').size().reindex(state.index)
+    rfm = pd.DataFrame({
+        'recency_days': (snapshot_date - state['last_date']).dt.days,
+        'frequency': state['frequency'],
+        'monetary': state['monetary'],
+        'units': state['units'],
+        'avg_units_per_tx': state['units'] / distinct_qty
+    }, index=state.index)
+    return rfm.reset_index()
+
+
+def score_rfm(rfm):
+    """Quintile R/F/M scores (ties broken by customer order, as in 007)."""
+    rfm['r_score'] = pd.qcut(rfm['recency_days'].rank(method='first'), 5, labels=[5,4,3,2,1]).astype(int)
+    rfm['f_score'] = pd.qcut(rfm['frequency'].rank(method='first'), 5, labels=[1,2,3,4,5]).astype(int)
+    rfm['m_score'] = pd.qcut(rfm['monetary'].rank(method='first'), 5, labels=[1,2,3,4,5]).astype(int)
+    rfm['rfm_score'] = rfm['r_score'].astype(str)+rfm['f_score'].astype(str)+rfm['m_score'].astype(str)
+    return rfm
+
+
+class RFMStore:
+    """Per-customer RFM state that new batches of chips rows are folded into."""
+
+    def __init__(self, state=None, qty_pairs=None, date_col='date'):
+        self.date_col = date_col
+        self.state = state if state is not None else pd.DataFrame(columns=STATE_COLS).rename_axis('customer_id')
+        self.qty_pairs = qty_pairs if qty_pairs is not None else pd.DataFrame(columns=['customer_id', 'quantity'])
+
+    def fold(self, batch):
+        state, qty_pairs = rfm_state(batch, self.date_col)
+        if self.state.empty:
+            self.state, self.qty_pairs = state.sort_index(), qty_pairs
+            return self
+        both = pd.concat([self.state, state])
+        self.state = both.groupby(level=0).agg(
+            last_date=('last_date', 'max'),
+            frequency=('frequency', 'sum'),
+            monetary=('monetary', 'sum'),
+            units=('units', 'sum')
+        )
+        self.state['monetary'] = self.state['monetary'].round(MONEY_DP)
+        self.qty_pairs = pd.concat([self.qty_pairs, qty_pairs]).drop_duplicates()
+        return self
+
+    def rfm(self, snapshot_date=None):
+        return rfm_table(self.state, self.qty_pairs, snapshot_date)
+
+    def verify(self, batch_rfm, snapshot_date=None):
+        """Assert that the folded state scores exactly like `batch_rfm` (score_rfm of the batch path)."""
+        folded = score_rfm(self.rfm(snapshot_date))
+        batch = batch_rfm.reset_index(drop=True)
+        pd.testing.assert_frame_equal(folded, batch, check_dtype=False, check_exact=True)
+        return self
+
+    @classmethod
+    def load(cls, path, date_col='date'):
+        path = Path(path)
+        if not (path / 'state.parquet').exists():
+            return cls(date_col=date_col)
+        return cls(pd.read_parquet(path / 'state.parquet'), pd.read_parquet(path / 'qty_pairs.parquet'), date_col)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.state.to_parquet(path / 'state.parquet')
+        self.qty_pairs.to_parquet(path / 'qty_pairs.parquet', index=False)
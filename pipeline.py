@@ -0,0 +1,235 @@
+# Pipeline runner: stage DAG over the analysis scripts with content-hash caching
+
+# pipeline.py
+# Run: python pipeline.py                 # run every stage whose cached outputs are stale
+#      python pipeline.py trial           # a stage and whatever it depends on
+#      python pipeline.py --dry-run       # show what would run and why
+#      python pipeline.py --force rfm -j 4
+#
+# Each stage runs one script in its own interpreter and declares the artifacts
+# it reads and writes (artifact names without extension resolve to the first of
+# .parquet/.feather/.csv, see qvi_schema.resolve). A stage's fingerprint is the
+# hash of its script, the helper modules it imports, its parameters (module-level
+# constants such as TRIAL_STORES, TRIAL_START, PRE_PERIOD_WEEKS) and the content
+# of its inputs. Stages whose fingerprint and outputs match the last successful
+# run are skipped, so editing TRIAL_STORES only reruns the trial stage.
+# Independent branches run concurrently.
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from qvi_schema import resolve
+from qvi_instrument import RUN_ID
+
+ROOT = Path(__file__).resolve().parent
+STATE_FILE = Path('.cache') / 'pipeline_state.json'
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    inputs: list
+    outputs: list
+    modules: list = field(default_factory=list)   # helper modules whose code affects the outputs
+    params: list = field(default_factory=list)    # module-level constants reported in the fingerprint
+
+
+STAGES = [
+    Stage('clean', '001_chips_analysis_start.py',
+          inputs=['transactions.csv', 'customers.csv'],
+          outputs=['transactions_clean', 'customers_clean', 'tx_cust_merged'],
+          modules=['chips_clean.py', 'qvi_rules.py', 'qvi_schema.py'], params=['STREAMING', 'RULE_ACTIONS']),
+    Stage('charts', '002_charts.py',
+          inputs=['tx_cust_merged'],
+          outputs=['fig_daily_chips_sales.png', 'fig_top10_stores.png', 'fig_top_skus.png', 'fig_chips_basket_dist.png'],
+          modules=['chips_cube.py', 'qvi_charts.py', 'qvi_schema.py'], params=['VERIFY_CUBE']),
+    Stage('rfm', '003_customer_segmentation-rfm.py',
+          inputs=['tx_cust_merged'], outputs=['chips_rfm.csv'],
+          modules=['chips_rfm.py', 'qvi_schema.py']),
+    Stage('clusters', '004_customer_segmentation-k-means.py',
+          inputs=['tx_cust_merged'], outputs=['chips_customer_clusters.csv'],
+          modules=['chips_clusters.py', 'qvi_schema.py'], params=['SILHOUETTE_SAMPLE']),
+    Stage('basket', '005_basket-cross-sell-analysis.py',
+          inputs=['tx_cust_merged'],
+          outputs=['chips_basket_category_cooccurrence.csv', 'basket_category_rules.csv', 'basket_sku_rules.csv'],
+          modules=['chips_basket.py', 'qvi_schema.py'], params=['MIN_SUPPORT', 'TOP_K']),
+    Stage('qvi_prep', '007_chips_data_prep.py',
+          inputs=['QVI_transaction_data.xlsx', 'QVI_purchase_behaviour.csv'],
+          outputs=['tx_chips_clean', 'chips_customers_rfm.csv', 'chips_sales_by_pack_size.csv', 'chips_sales_by_brand_guess.csv'],
+          modules=['qvi_ingest.py', 'qvi_products.py', 'chips_clean.py', 'qvi_rules.py', 'chips_rfm.py', 'chips_lazy.py', 'chips_cube.py',
+                   'qvi_charts.py', 'qvi_schema.py'],
+          params=['BACKEND', 'RULE_ACTIONS', 'VERIFY_CUBE', 'VERIFY_RFM']),
+    Stage('trial', '011_trial_analysis.py',
+          inputs=['tx_chips_clean'], outputs=['outputs/match_table.csv', 'outputs/store_results.csv'],
+          modules=['trial_bootstrap.py', 'trial_did.py', 'trial_placebo.py', 'trial_matching.py', 'trial_panel.py', 'chips_cube.py', 'qvi_charts.py', 'qvi_schema.py'],
+          params=['TRIAL_STORES', 'TRIAL_START', 'TRIAL_END', 'PRE_PERIOD_WEEKS', 'N_CONTROLS', 'MATCH_FREQ',
+                  'NBOOT', 'BOOT_BLOCK', 'BOOT_SEED', 'PLACEBO', 'SWEEP_STARTS', 'SWEEP_LENGTHS']),
+]
+
+
+def _artifact(name):
+    # existing file for an artifact: exact path if it has an extension, else the preferred format
+    if Path(name).suffix:
+        return Path(name) if Path(name).exists() else None
+    try:
+        return resolve(name)
+    except FileNotFoundError:
+        return None
+
+
+class FileHashes:
+    """sha256 of files, memoized on (size, mtime) so unchanged files are not re-read."""
+
+    def __init__(self, memo):
+        self.memo = memo
+
+    def __call__(self, path):
+        st = path.stat()
+        key = str(path)
+        hit = self.memo.get(key)
+        if hit and hit['size'] == st.st_size and hit['mtime_ns'] == st.st_mtime_ns:
+            return hit['sha256']
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.memo[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': h.hexdigest()}
+        return h.hexdigest()
+
+
+def script_params(script, names):
+    """Source text of the module-level assignments to `names` in `script`."""
+    src = (ROOT / script).read_text()
+    found = {}
+    for node in ast.parse(src).body:
+        if isinstance(node, ast.Assign):
+            for t in node.targets:
+                if isinstance(t, ast.Name) and t.id in names:
+                    found[t.id] = ast.get_source_segment(src, node.value)
+    return found
+
+
+def fingerprint(stage, file_hash):
+    """Hash of code, parameters and input contents; None if an input is missing."""
+    parts = {'script': file_hash(ROOT / stage.script),
+             'modules': {m: file_hash(ROOT / m) for m in stage.modules},
+             'params': script_params(stage.script, stage.params),
+             'inputs': {}}
+    for name in stage.inputs:
+        path = _artifact(name)
+        if path is None:
+            return None, parts
+        parts['inputs'][name] = file_hash(path)
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest(), parts
+
+
+def dependencies(stages):
+    producers = {out: s.name for s in stages for out in s.outputs}
+    return {s.name: {producers[i] for i in s.inputs if i in producers} for s in stages}
+
+
+def select(stages, targets, deps):
+    if not targets:
+        return [s.name for s in stages]
+    wanted, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+    return [s.name for s in stages if s.name in wanted]
+
+
+def run_stage(stage):
+    start = time.perf_counter()
+    # the scripts' stage records (qvi_instrument.py) carry this pipeline run's id
+    proc = subprocess.run([sys.executable, str(ROOT / stage.script)], capture_output=True, text=True,
+                          env={**os.environ, 'QVI_RUN_ID': RUN_ID})
+    return proc.returncode, proc.stdout + proc.stderr, time.perf_counter() - start
+
+
+def run(targets=(), force=False, dry_run=False, jobs=None):
+    by_name = {s.name: s for s in STAGES}
+    deps = dependencies(STAGES)
+    order = select(STAGES, targets, deps)
+    state = json.loads(STATE_FILE.read_text()) if STATE_FILE.exists() else {'stages': {}, 'files': {}}
+    file_hash = FileHashes(state['files'])
+
+    done, failed, running = set(), set(), {}
+    pending = list(order)
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        while pending or running:
+            # launch every stage whose upstream stages have finished
+            for name in list(pending):
+                upstream = deps[name] & set(order)
+                if upstream & failed:
+                    print(f'[skip] {name}: upstream failed')
+                    failed.add(name); pending.remove(name)
+                    continue
+                if not upstream <= done:
+                    continue
+                pending.remove(name)
+                stage = by_name[name]
+                fp, parts = fingerprint(stage, file_hash)
+                prev = state['stages'].get(name, {})
+                outputs = [_artifact(o) for o in stage.outputs]
+                fresh = (fp is not None and prev.get('fingerprint') == fp and all(outputs)
+                         and all(prev.get('outputs', {}).get(o) == file_hash(p) for o, p in zip(stage.outputs, outputs)))
+                if fp is None:
+                    print(f'[fail] {name}: missing input(s) {[i for i in stage.inputs if _artifact(i) is None]}')
+                    failed.add(name)
+                elif fresh and not force:
+                    print(f'[cached] {name}')
+                    done.add(name)
+                elif dry_run:
+                    print(f'[would run] {name}  params={parts["params"]}')
+                    done.add(name)
+                else:
+                    print(f'[run] {name}')
+                    running[ex.submit(run_stage, stage)] = (name, fp)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name, fp = running.pop(fut)
+                code, log, secs = fut.result()
+                stage = by_name[name]
+                if code != 0:
+                    print(f'[fail] {name} ({secs:.1f}s)\n{log}')
+                    failed.add(name)
+                    continue
+                missing = [o for o in stage.outputs if _artifact(o) is None]
+                if missing:
+                    print(f'[fail] {name}: did not write {missing}')
+                    failed.add(name)
+                    continue
+                state['stages'][name] = {'fingerprint': fp,
+                                         'outputs': {o: file_hash(_artifact(o)) for o in stage.outputs}}
+                print(f'[done] {name} ({secs:.1f}s)')
+                done.add(name)
+
+    if not dry_run:
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        STATE_FILE.write_text(json.dumps(state, indent=1))
+    return not failed
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Run the chips analysis stages, skipping cached ones.')
+    ap.add_argument('targets', nargs='*', help=f'stages to run (with their upstream): {[s.name for s in STAGES]}')
+    ap.add_argument('--force', action='store_true', help='rerun selected stages even if cached')
+    ap.add_argument('--dry-run', action='store_true', help='only report what would run')
+    ap.add_argument('-j', '--jobs', type=int, default=None, help='max stages running at once')
+    args = ap.parse_args()
+    unknown = set(args.targets) - {s.name for s in STAGES}
+    if unknown:
+        ap.error(f'unknown stage(s): {sorted(unknown)}')
+    sys.exit(0 if run(args.targets, args.force, args.dry_run, args.jobs) else 1)
@@ -0,0 +1,128 @@
+# Chart rendering: figures from small pre-aggregated series, Agg OO API, worker pool, hash cache
+
+# qvi_charts.py
+# Usage (002, 007, 011):
+#   specs = [ChartSpec('fig_top10_stores.png', 'bar', {'labels': ids, 'values': sales},
+#                      {'figsize': (10,5), 'title': 'Top 10 Stores by Chips Sales', 'xrot': 90})]
+#   render_all(specs, n_workers=None)        # renders only figures whose data/style changed
+#
+# A figure is described by a ChartSpec: its output path, a kind ('line', 'bar',
+# 'hist'), the already aggregated series it draws and style parameters. Each
+# spec is drawn on its own matplotlib Figure with an Agg canvas (no pyplot, so no
+# shared current figure), in a process pool when there is more than one to draw.
+# The hash of kind, data, style and RENDER_VERSION is stamped per output under
+# .cache/figures; a figure whose stamp matches and whose file exists is skipped.
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+STAMP_DIR = Path('.cache') / 'figures'
+RENDER_VERSION = 1   # bump when the drawing code below changes
+
+
+@dataclass
+class ChartSpec:
+    path: str
+    kind: str                                   # 'line' | 'bar' | 'hist'
+    data: dict                                  # line: series=[(label, x, y)], vline; bar: labels, values; hist: values
+    style: dict = field(default_factory=dict)   # figsize, title, xlabel, ylabel, xrot, legend, bins, dpi
+
+
+def _digest(h, obj):
+    # stable content hash of nested dicts/lists of arrays and scalars
+    if isinstance(obj, dict):
+        for k in sorted(obj):
+            h.update(str(k).encode())
+            _digest(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'[{len(obj)}'.encode())
+        for v in obj:
+            _digest(h, v)
+    elif isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        a = np.asarray(obj)
+        if a.dtype == object:
+            a = a.astype(str)
+        h.update(str(a.dtype).encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    else:
+        h.update(repr(obj).encode())
+
+
+def spec_hash(spec):
+    h = hashlib.sha256(f'{RENDER_VERSION}:{spec.kind}'.encode())
+    _digest(h, spec.data)
+    h.update(json.dumps(spec.style, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def _stamp(path):
+    return STAMP_DIR / (hashlib.sha1(str(Path(path).resolve()).encode()).hexdigest() + '.txt')
+
+
+def render(spec):
+    """Draw one spec with the object-oriented Agg API and save it (atomically)."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    style, data = spec.style, spec.data
+    fig = Figure(figsize=style.get('figsize', (6.4, 4.8)))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    if spec.kind == 'line':
+        for label, x, y in data['series']:
+            ax.plot(x, y, label=label)
+        if data.get('vline') is not None:
+            ax.axvline(data['vline'], color='k', linestyle='--', label=data.get('vline_label'))
+    elif spec.kind == 'bar':
+        pos = np.arange(len(data['labels']))
+        ax.bar(pos, data['values'])
+        ax.set_xticks(pos, [str(v) for v in data['labels']])
+    elif spec.kind == 'hist':
+        ax.hist(data['values'], bins=style.get('bins', 10))
+    else:
+        raise ValueError(f'unknown chart kind {spec.kind!r}')
+    if 'title' in style:
+        ax.set_title(style['title'])
+    if 'xlabel' in style:
+        ax.set_xlabel(style['xlabel'])
+    if 'ylabel' in style:
+        ax.set_ylabel(style['ylabel'])
+    if 'xrot' in style:
+        ax.tick_params(axis='x', labelrotation=style['xrot'])
+    if style.get('legend'):
+        ax.legend()
+    if style.get('tight'):
+        fig.tight_layout()
+    path = Path(spec.path)
+    tmp = path.with_name(path.name + '.tmp')
+    fig.savefig(tmp, format=path.suffix[1:], dpi=style.get('dpi', 100))
+    tmp.replace(path)
+    return str(path)
+
+
+def render_all(specs, n_workers=None, force=False):
+    """Render the specs whose data or style changed since their last render.
+
+    Returns (rendered paths, skipped paths). n_workers=1 renders in-process.
+    """
+    todo, skipped, hashes = [], [], {}
+    for spec in specs:
+        hashes[spec.path] = spec_hash(spec)
+        stamp = _stamp(spec.path)
+        if (not force and Path(spec.path).exists() and stamp.exists()
+                and stamp.read_text() == hashes[spec.path]):
+            skipped.append(spec.path)
+        else:
+            todo.append(spec)
+    if n_workers == 1 or len(todo) < 2:
+        rendered = [render(s) for s in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as ex:
+            rendered = list(ex.map(render, todo))
+    STAMP_DIR.mkdir(parents=True, exist_ok=True)
+    for spec in todo:
+        _stamp(spec.path).write_text(hashes[spec.path])
+    return rendered, skipped
@@ -0,0 +1,115 @@
+# QVI transaction ingest: vectorized Excel-serial dates + columnar cache
+
+# qvi_ingest.py
+# Usage (from the prep scripts):
+#   from qvi_ingest import load_transactions
+#   tx = load_transactions('QVI_transaction_data.xlsx', sheet_name='in')
+#
+# The parsed, typed table is cached as Parquet under CACHE_DIR, keyed by the
+# sha256 of the workbook, so later runs skip the Excel parse until it changes.
+import hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = Path('.cache')
+CACHE_VERSION = 1  # bump when the parse/typing logic below changes
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+
+TX_RENAME = {
+    'lylty_card_nbr':'customer_id',
+    'prod_qty':'quantity',
+    'tot_sales':'line_total',
+    'txn_id':'transaction_id',
+    'prod_name':'product_description',
+    'prod_nbr':'sku',
+    'store_nbr':'store_id'
+}
+TX_NUMERIC = ['store_id', 'customer_id', 'transaction_id', 'sku', 'quantity', 'line_total']
+
+
+def excel_serial_to_dates(s):
+    """Convert a whole column of Excel serials to datetimes in one pass.
+
+    Only values that fail numeric parsing (e.g. real dates or date strings)
+    go through the slower pd.to_datetime fallback.
+    """
+    s = pd.Series(s)
+    num = pd.to_numeric(s, errors='coerce')
+    out = EXCEL_EPOCH + pd.to_timedelta(np.trunc(num), unit='D')
+    fallback = num.isna() & s.notna()
+    if fallback.any():
+        out[fallback] = pd.to_datetime(s[fallback].astype(str), errors='coerce', format='mixed')
+    return out
+
+
+def file_hash(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def normalize_columns(df):
+    df.columns = [str(c).strip().lower().replace(' ', '_') for c in df.columns]
+    return df
+
+
+def parse_transactions(raw):
+    """Normalize names and types of a raw QVI transaction sheet (dtype=object)."""
+    tx = normalize_columns(raw)
+    date_col = 'date' if 'date' in tx.columns else tx.columns[0]
+    tx['date'] = excel_serial_to_dates(tx[date_col])
+    tx = tx.rename(columns=TX_RENAME)
+    for c in TX_NUMERIC:
+        if c in tx.columns:
+            tx[c] = pd.to_numeric(tx[c], errors='coerce')
+    if 'product_description' in tx.columns:
+        tx['product_description'] = tx['product_description'].astype('string')
+    return tx
+
+
+def _cache_path(path, sheet_name, digest, cache_dir):
+    return Path(cache_dir) / f'{Path(path).stem}-{sheet_name}-v{CACHE_VERSION}-{digest[:16]}.parquet'
+
+
+def load_transactions(path, sheet_name='in', cache_dir=CACHE_DIR, use_cache=True):
+    """Load the QVI transaction workbook (or its CSV export) as a typed frame, via the Parquet cache when valid."""
+    cache = None
+    if use_cache:
+        cache = _cache_path(path, sheet_name, file_hash(path), cache_dir)
+        if cache.exists():
+            try:
+                return pd.read_parquet(cache)
+            except ImportError:
+                cache = None  # no parquet engine installed; parse as usual
+
+    if Path(path).suffix == '.csv':
+        raw = pd.read_csv(path, dtype=object)   # same sheet as CSV, e.g. a large synthetic extract (qvi_synth.py)
+    else:
+        raw = pd.read_excel(path, sheet_name=sheet_name, dtype=object)
+    tx = parse_transactions(raw)
+
+    if cache is not None:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache.with_suffix('.tmp')
+        try:
+            tx.to_parquet(tmp, index=False)
+            tmp.replace(cache)
+        except ImportError:
+            pass
+    return tx
+
+
+def transactions_parquet(path, sheet_name='in', cache_dir=CACHE_DIR):
+    """Path of a typed Parquet copy of the transactions, for out-of-core readers.
+
+    A .parquet input is used as-is; a workbook is parsed into the ingest cache once.
+    """
+    if Path(path).suffix == '.parquet':
+        return Path(path)
+    cache = _cache_path(path, sheet_name, file_hash(path), cache_dir)
+    if not cache.exists():
+        load_transactions(path, sheet_name, cache_dir)
+    return cache
@@ -0,0 +1,154 @@
+# Stage instrumentation: timing, memory and row-flow records written as JSON lines
+
+# qvi_instrument.py
+# Usage (001, 007, 011):
+#   with stage('dedup', rows_in=len(tx)) as st:
+#       tx = st.keep(tx, ~tx.duplicated(['transaction_id','sku']), 'duplicate')
+#
+# Each stage appends one record to LOG_PATH (.cache/stages.jsonl, or the file in
+# $QVI_STAGE_LOG; empty disables it): run id, script, stage, status, wall and CPU
+# time, RSS after the stage and its delta, the process peak RSS so far, rows in
+# and out, and rows dropped per filter reason. The cost is a few clock/rusage
+# reads and one appended line per stage, so it stays on by default.
+# QVI_TRACE_ALLOC=1 starts tracemalloc at import and adds the traced allocation
+# delta and peak per stage (slow; nested stages reset the peak of the outer one).
+# QVI_PROFILE=stage1,stage2 runs those stages under the pyinstrument sampling
+# profiler and saves an HTML profile under PROFILE_DIR. pipeline.py passes
+# QVI_RUN_ID to its scripts so one pipeline run shares a run id.
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+LOG_PATH = os.environ.get('QVI_STAGE_LOG', str(Path('.cache') / 'stages.jsonl')) or None
+PROFILE_DIR = Path('.cache') / 'profiles'
+PROFILE_STAGES = {s.strip() for s in os.environ.get('QVI_PROFILE', '').split(',') if s.strip()}
+RUN_ID = os.environ.get('QVI_RUN_ID') or f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}'
+SCRIPT = Path(sys.argv[0]).name if sys.argv and sys.argv[0] else None
+
+if os.environ.get('QVI_TRACE_ALLOC') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_lock = threading.Lock()
+
+
+def rss_mb():
+    """Current resident set size of this process (MB); the peak if psutil is missing."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (MB), None where `resource` is unavailable."""
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10   # bytes on macOS, KiB on Linux
+
+
+def _json_default(o):
+    # numpy scalars and anything else without a JSON type
+    return o.item() if hasattr(o, 'item') else str(o)
+
+
+class JsonlSink:
+    """Appends one JSON object per line; safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def write(self, record):
+        line = json.dumps(record, default=_json_default) + '\n'
+        with _lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+sink = JsonlSink(LOG_PATH) if LOG_PATH else None
+
+
+class StageRecord:
+    """Row flow of one stage; filled in by the code inside `with stage(...)`."""
+
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.dropped = {}
+        self.extra = {}
+
+    def drop(self, reason, n):
+        self.dropped[reason] = self.dropped.get(reason, 0) + int(n)
+
+    def keep(self, df, mask, reason):
+        """Rows of `df` where `mask` is True; the others are counted as dropped for `reason`."""
+        kept = df[mask]
+        self.drop(reason, len(df) - len(kept))
+        self.rows_out = len(kept)
+        return kept
+
+    def note(self, **kv):
+        self.extra.update(kv)
+
+
+def _start_profiler():
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        raise ImportError('QVI_PROFILE needs pyinstrument (pip install pyinstrument)')
+    prof = Profiler(interval=0.001)
+    prof.start()
+    return prof
+
+
+@contextmanager
+def stage(name, rows_in=None, profile=False, **meta):
+    """Measure the enclosed block as stage `name` and append its record to the sink.
+
+    Yields a StageRecord; set `rows_out` on it (or use keep/drop) to log the row
+    flow. Extra keyword arguments are stored in the record as they are.
+    """
+    rec = StageRecord(rows_in)
+    prof = _start_profiler() if profile or name in PROFILE_STAGES else None
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        alloc0 = tracemalloc.get_traced_memory()[0]
+    rss0 = rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    status = 'ok'
+    try:
+        yield rec
+    except BaseException as e:
+        status = f'error: {type(e).__name__}'
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        rss = rss_mb()
+        record = {'ts': time.strftime('%Y-%m-%dT%H:%M:%S'), 'run': RUN_ID, 'script': SCRIPT, 'stage': name,
+                  'status': status, 'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+                  'rss_mb': rss, 'rss_delta_mb': rss - rss0, 'peak_rss_mb': peak_rss_mb(),
+                  'rows_in': rec.rows_in, 'rows_out': rec.rows_out, 'dropped': rec.dropped}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            record.update(alloc_delta_mb=(current - alloc0) / 2**20, alloc_peak_mb=peak / 2**20)
+        if prof is not None:
+            prof.stop()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            path = PROFILE_DIR / f'{RUN_ID}-{name}.html'
+            path.write_text(prof.output_html())
+            record['profile'] = str(path)
+        record.update(meta)
+        record.update(rec.extra)
+        if sink is not None:
+            sink.write(record)
+
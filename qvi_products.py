@@ -0,0 +1,104 @@
+# Product dimension: pack size, brand and chips flag per distinct description
+
+# qvi_products.py
+# Usage (from the prep scripts):
+#   from qvi_products import load_product_lookup, update_product_lookup, save_product_lookup, product_attributes
+#   products = update_product_lookup(load_product_lookup(PRODUCT_LOOKUP), tx['product_description'])
+#   save_product_lookup(products, PRODUCT_LOOKUP)
+#   tx = tx.join(product_attributes(tx['product_description'], products))
+#
+# Attributes are parsed once per distinct description (a few hundred) instead of
+# once per transaction row, then broadcast back by factorized integer code. The
+# lookup is persisted so new extracts only parse descriptions not seen before;
+# its file name carries a hash of the patterns below and PARSER_VERSION, so
+# editing the parsing rules starts a new lookup instead of reusing stale rows.
+import hashlib
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PARSER_VERSION = 1   # bump when parse_description changes (pattern edits change the key by themselves)
+ATTRIBUTES = ['pack_size', 'brand_guess', 'is_chips']
+
+PACK_RE = re.compile(r'(\d+\s?g|\d+\s?kg|\d+\s?ml|\d+\s?l|\d+\s?ct|\d+\s?g\w?)')
+BRAND_SPLIT_RE = re.compile(r'[\s\-\(\)\,\/]+')
+CHIPS_RE = re.compile(r'chip|crisp|potato|dorito|doritos')
+
+_PARSER_KEY = hashlib.sha256(repr((PARSER_VERSION, ATTRIBUTES) + tuple(
+    (r.pattern, r.flags) for r in (PACK_RE, BRAND_SPLIT_RE, CHIPS_RE))).encode()).hexdigest()[:16]
+PRODUCT_LOOKUP = Path('.cache') / f'product_lookup-{_PARSER_KEY}.parquet'
+
+
+def parse_description(desc):
+    """Return (pack_size, brand_guess, is_chips) for a single product description."""
+    s = str(desc)
+    low = s.lower()
+    m = PACK_RE.search(low)
+    pack = m.group(0).replace(' ', '') if m else np.nan
+    tokens = BRAND_SPLIT_RE.split(s)
+    brand = tokens[0].title() if tokens else np.nan
+    return pack, brand, CHIPS_RE.search(low) is not None
+
+
+def empty_lookup():
+    lookup = pd.DataFrame({
+        'pack_size': pd.Series(dtype=object),
+        'brand_guess': pd.Series(dtype=object),
+        'is_chips': pd.Series(dtype=bool),
+    })
+    lookup.index.name = 'product_description'
+    return lookup
+
+
+def load_product_lookup(path=PRODUCT_LOOKUP):
+    path = Path(path)
+    if not path.exists():
+        return empty_lookup()
+    try:
+        return pd.read_parquet(path)
+    except ImportError:
+        return empty_lookup()
+
+
+def save_product_lookup(lookup, path=PRODUCT_LOOKUP):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    try:
+        lookup.to_parquet(tmp)
+        tmp.replace(path)
+    except ImportError:
+        pass  # no parquet engine installed; lookup is rebuilt each run
+
+
+def update_product_lookup(lookup, descriptions):
+    """Parse descriptions not yet in the lookup and append them."""
+    uniques = pd.unique(descriptions.dropna().astype(str))
+    new = [d for d in uniques if d not in lookup.index]
+    if not new:
+        return lookup
+    parsed = pd.DataFrame([parse_description(d) for d in new], index=pd.Index(new, name='product_description'), columns=ATTRIBUTES)
+    parsed['is_chips'] = parsed['is_chips'].astype(bool)
+    if lookup.empty:
+        return parsed
+    return pd.concat([lookup, parsed])
+
+
+def product_attributes(descriptions, lookup, columns=ATTRIBUTES):
+    """Broadcast lookup attributes back onto every row of `descriptions`.
+
+    Missing descriptions get NaN pack size/brand and is_chips=False. Every
+    non-null description must already be in the lookup (see update_product_lookup).
+    """
+    codes, uniques = pd.factorize(descriptions)
+    dim = lookup.reindex(pd.Index(uniques).astype(str))
+    out = {}
+    for c in columns:
+        # codes == -1 (null description) index the trailing null slot
+        if c == 'is_chips':
+            vals = np.append(dim[c].fillna(False).to_numpy(bool), False)
+        else:
+            vals = np.append(dim[c].to_numpy(object), np.nan)
+        out[c] = vals[codes]
+    return pd.DataFrame(out, index=descriptions.index)
@@ -0,0 +1,249 @@
+# Declarative data-quality rules evaluated in one vectorized pass into a per-row bitmask
+
+# qvi_rules.py
+# Usage (chips_clean.py for 001, 007):
+#   rules = [required(COLS), not_null(COLS), duplicate(['transaction_id','sku']),
+#            numeric('quantity'), positive('quantity'), outlier(['quantity','price'])]
+#   res = evaluate(tx, rules, actions={'non_positive:quantity': 'quarantine'})
+#   res.counts()                       # per rule: action, failed, removed, flagged in the kept rows
+#   clean, quarantine = res.split(tx)  # the only row copies made
+#
+# A rule names the columns it reads and a vectorized check returning the rows
+# that violate it; its action says what happens to those rows: 'flag' (counted,
+# kept), 'drop' or 'quarantine' (returned separately with the failed rule names).
+# Each column is prepared once per evaluation (null mask, numeric coercion,
+# lower-cased text) and shared by every rule on it. Rule i sets bit i of a uint64
+# per row, so results are 8 bytes per row whatever the number of rules, and
+# any count is a bit test. Rules with a `stat` (outlier thresholds) are evaluated
+# last, over the rows no drop/quarantine rule removed: their statistic is
+# computed on those rows (unless the thresholds are passed in, e.g. from a
+# streaming sketch) and only those rows can fail them, so a chunked pass over
+# the cleaned output counts the same failures.
+# A removed row is attributed to the first removing rule it fails, in order.
+from dataclasses import dataclass, replace
+from typing import Callable
+import numpy as np
+import pandas as pd
+
+ACTIONS = ('flag', 'drop', 'quarantine')
+MAX_RULES = 64
+
+
+@dataclass
+class Rule:
+    name: str
+    columns: list
+    check: Callable = None     # (ColumnView[, stat]) -> rows violating the rule
+    action: str = 'flag'       # 'flag' | 'drop' | 'quarantine'
+    fix: Callable = None       # ColumnView -> cleaned column written back by split()
+    stat: Callable = None      # (ColumnView, kept rows) -> statistic passed to check
+    kind: str = 'row'          # 'row' | 'required' (schema check, no row bits)
+
+
+class ColumnView:
+    """Per-column prepared arrays of one frame, computed on first use."""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._cache = {}
+
+    def _get(self, key, col, make):
+        if (key, col) not in self._cache:
+            self._cache[key, col] = make(self.frame[col])
+        return self._cache[key, col]
+
+    def raw(self, col):
+        return self.frame[col]
+
+    def isnull(self, col):
+        return self._get('null', col, lambda s: s.isnull().to_numpy())
+
+    def num(self, col):
+        return self._get('num', col, lambda s: pd.to_numeric(s, errors='coerce'))
+
+    def lower(self, col):
+        return self._get('lower', col, lambda s: s.str.lower().fillna(''))
+
+
+def _mask(x):
+    if hasattr(x, 'to_numpy'):
+        return x.to_numpy(dtype=bool, na_value=False)
+    return np.asarray(x, dtype=bool)
+
+
+# --- rule constructors ---
+
+def required(cols, name='required'):
+    """Schema rule: the columns must exist (missing ones are listed in Result.missing)."""
+    return Rule(name, list(cols), kind='required')
+
+
+def not_null(cols, action='flag'):
+    """One rule per column, named 'null:<col>'."""
+    return [Rule(f'null:{c}', [c], lambda v, c=c: v.isnull(c), action) for c in cols]
+
+
+def numeric(col, action='drop'):
+    """Value missing or not a number; the coerced column is written back."""
+    return Rule(f'numeric:{col}', [col], lambda v: v.num(col).isna(), action, fix=lambda v: v.num(col))
+
+
+def positive(col, action='drop'):
+    """Numeric value <= 0 (missing values pass; see numeric/not_null)."""
+    return Rule(f'non_positive:{col}', [col], lambda v: v.num(col) <= 0, action)
+
+
+def duplicate(keys, action='drop', seen=None, name='duplicate'):
+    """Repeated key: every occurrence after the first, or keys already in `seen` (a chips_clean.KeySet)."""
+    keys = list(keys)
+    if seen is None:
+        return Rule(name, keys, lambda v: v.frame.duplicated(subset=keys), action)
+    return Rule(name, keys, lambda v: ~seen.add_new(v.frame, keys), action)
+
+
+def is_true(col, name, action='drop'):
+    """Boolean flag column not True (e.g. is_chips)."""
+    return Rule(name, [col], lambda v: ~_mask(v.raw(col) == True), action)   # noqa: E712 (NA fails)
+
+
+def normalized(col, func, action='flag', name=None):
+    """Normalization: writes func(column) back; the rule's rows are those the fix changed."""
+    def fix(v):
+        return v._get('fix', col, func)
+
+    def check(v):
+        return ~_mask(fix(v) == v.raw(col))
+    return Rule(name or f'normalized:{col}', [col], check, action, fix=fix)
+
+
+def outlier(cols, q=0.99, multiple=5, action='flag', name='outlier'):
+    """Any column above `multiple` x its q-quantile over the kept rows."""
+    cols = list(cols)
+
+    def stat(v, kept):
+        return pd.DataFrame({c: v.num(c)[kept] for c in cols}).quantile(q).to_dict()
+
+    def check(v, thr):
+        bad = np.zeros(len(v.frame), dtype=bool)
+        for c in cols:
+            bad |= _mask(v.num(c) > thr[c] * multiple)
+        return bad
+    return Rule(name, cols, check, action, stat=stat)
+
+
+# --- evaluation ---
+
+class Result:
+    """Bitmask outcome of evaluate(); bit i of `bits` is set where rule i failed."""
+
+    def __init__(self, rules, bits, missing, skipped, thresholds, fixes):
+        self.rules = rules
+        self.bits = bits
+        self.missing = missing
+        self.skipped = skipped
+        self.thresholds = thresholds
+        self.fixes = fixes
+        self.index = {r.name: i for i, r in enumerate(rules)}
+        # first removing rule each row fails (-1: kept); decides drop vs quarantine and attribution
+        self.first = np.full(len(bits), -1, dtype=np.int8)
+        for i, r in enumerate(rules):
+            if r.action != 'flag':
+                self.first[(self.first < 0) & ((bits >> np.uint64(i)) & np.uint64(1)).astype(bool)] = i
+
+    def failed(self, name):
+        """Rows failing rule `name` (bool array)."""
+        return ((self.bits >> np.uint64(self.index[name])) & np.uint64(1)).astype(bool)
+
+    def count(self, name, where=None):
+        f = self.failed(name)
+        return int(f.sum() if where is None else (f & where).sum())
+
+    @property
+    def keep(self):
+        return self.first < 0
+
+    @property
+    def quarantined(self):
+        acts = np.array([r.action == 'quarantine' for r in self.rules] + [False])
+        return acts[self.first]    # first == -1 picks the trailing False
+
+    def removed(self):
+        """Removed rows per drop/quarantine rule, each row counted once (first failing rule)."""
+        n = np.bincount(self.first[self.first >= 0], minlength=len(self.rules))
+        return {r.name: int(n[i]) for i, r in enumerate(self.rules) if r.action != 'flag'}
+
+    def counts(self):
+        keep, removed = self.keep, self.removed()
+        return pd.DataFrame({
+            'rule': [r.name for r in self.rules],
+            'action': [r.action for r in self.rules],
+            'failed': [self.count(r.name) for r in self.rules],
+            'removed': [removed.get(r.name, 0) for r in self.rules],
+            'flagged_kept': [self.count(r.name, keep) for r in self.rules]
+        })
+
+    def failed_rules(self, rows):
+        """Comma-joined names of the rules each selected row fails."""
+        bits = self.bits[rows]
+        names = [r.name for r in self.rules]
+        return [','.join(n for i, n in enumerate(names) if b >> i & 1) for b in bits.tolist()]
+
+    def split(self, frame):
+        """(kept rows, quarantined rows + failed_rules) of `frame`, with the rules' fixes applied."""
+        keep, quar = self.keep, self.quarantined
+        clean, quarantine = frame[keep], frame[quar]
+        for col, values in self.fixes.items():
+            values = getattr(values, 'array', values)   # positional, keeps the dtype
+            clean[col] = values[keep]
+            quarantine[col] = values[quar]
+        quarantine['failed_rules'] = self.failed_rules(quar)
+        return clean, quarantine
+
+
+def _flatten(rules):
+    out = []
+    for r in rules:
+        out.extend(_flatten(r) if isinstance(r, (list, tuple)) else [r])
+    return out
+
+
+def evaluate(frame, rules, actions=None, thresholds=None):
+    """Evaluate `rules` on `frame` into a Result.
+
+    `actions` overrides rule actions by name; `thresholds` maps a stat rule's
+    name to precomputed statistics (otherwise computed over the kept rows).
+    """
+    rules = [replace(r, action=actions[r.name]) if actions and r.name in actions else r
+             for r in _flatten(rules)]
+    for r in rules:
+        if r.action not in ACTIONS:
+            raise ValueError(f'rule {r.name!r}: action must be one of {ACTIONS}, not {r.action!r}')
+    schema = [r for r in rules if r.kind == 'required']
+    rules = [r for r in rules if r.kind != 'required']
+    if len(rules) > MAX_RULES:
+        raise ValueError(f'at most {MAX_RULES} row rules per evaluation')
+
+    missing = [c for r in schema for c in r.columns if c not in frame.columns]
+    view = ColumnView(frame)
+    bits = np.zeros(len(frame), dtype=np.uint64)
+    skipped, stats, fixes = [], {}, {}
+    removing = np.uint64(0)
+    order = [i for i, r in enumerate(rules) if r.stat is None] + [i for i, r in enumerate(rules) if r.stat is not None]
+    for i in order:
+        r = rules[i]
+        if any(c not in frame.columns for c in r.columns):
+            skipped.append(r.name)
+            continue
+        if r.stat is not None:
+            kept = (bits & removing) == 0
+            stats[r.name] = thresholds[r.name] if thresholds and r.name in thresholds else r.stat(view, kept)
+            bad = _mask(r.check(view, stats[r.name])) & kept
+        else:
+            bad = _mask(r.check(view))
+        bits |= bad.astype(np.uint64) << np.uint64(i)
+        if r.action != 'flag':
+            removing |= np.uint64(1) << np.uint64(i)
+        if r.fix is not None:
+            for c in r.columns:
+                fixes[c] = r.fix(view)
+    return Result(rules, bits, missing, skipped, stats, fixes)
@@ -0,0 +1,100 @@
+# Canonical column types and columnar (Parquet/Feather) interchange for stage artifacts
+
+# qvi_schema.py
+# Stage outputs are written with write_table and read back with read_table:
+#   write_table(chips, OUT_DIR / 'tx_chips_clean')                  # -> tx_chips_clean.parquet
+#   tx = read_table('tx_chips_clean', columns=['store_id','date','line_total'])
+#
+# Artifacts are addressed without an extension; read_table picks the first of
+# <name>.parquet / .feather / .csv that exists (a fixed priority, so a CSV copy
+# written for the R scripts next to the Parquet file is never read back), reads
+# only the requested columns and applies the canonical types below, so consumers
+# get the same compact frame whichever format produced it. Writers go through
+# write_table / artifact_path, which delete copies in a higher-priority format
+# so a stale one cannot shadow the new output (the streaming path in 001 writes CSV).
+from pathlib import Path
+import pandas as pd
+
+CATEGORICAL = ['store_id', 'sku', 'brand_guess', 'pack_size', 'lifestage', 'premium_customer']
+INT_KEYS = ['transaction_id', 'customer_id']
+DATES = ['date', 'transaction_date', 'signup_date']
+BOOLEAN = ['is_chips']
+FORMATS = ['.parquet', '.feather', '.csv']
+
+
+def apply_schema(df):
+    """Cast the canonical columns present in `df` (others are left untouched)."""
+    for c in DATES:
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = pd.to_datetime(df[c], errors='coerce')
+    for c in INT_KEYS:
+        if c in df.columns and df[c].notna().all() and pd.api.types.is_numeric_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], downcast='integer')
+    for c in BOOLEAN:
+        if c in df.columns and df[c].notna().all():
+            df[c] = df[c].astype(bool)
+    for c in CATEGORICAL:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype('category')
+    return df
+
+
+def resolve(name):
+    """Existing file for artifact `name` (a path with or without extension), in FORMATS order."""
+    path = Path(name)
+    if path.suffix in FORMATS:
+        return path
+    for ext in FORMATS:
+        if path.with_suffix(ext).exists():
+            return path.with_suffix(ext)
+    raise FileNotFoundError(f'no parquet/feather/csv artifact for {name}')
+
+
+def artifact_path(name, fmt='.parquet'):
+    """Path to write artifact `name` as `fmt`; removes its copies in formats resolve() would prefer."""
+    path = Path(name)
+    if path.suffix in FORMATS:
+        path, fmt = path.with_suffix(''), path.suffix
+    for ext in FORMATS[:FORMATS.index(fmt)]:
+        path.with_suffix(ext).unlink(missing_ok=True)
+    return path.with_suffix(fmt)
+
+
+def columns_of(path):
+    path = Path(path)
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    if path.suffix == '.feather':
+        import pyarrow.ipc as ipc
+        return ipc.open_file(path).schema.names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def read_table(name, columns=None):
+    """Load an artifact, projecting to `columns` (missing ones are skipped) and applying the schema."""
+    path = resolve(name)
+    if columns is not None:
+        available = set(columns_of(path))
+        columns = [c for c in columns if c in available]
+    if path.suffix == '.parquet':
+        df = pd.read_parquet(path, columns=columns)
+    elif path.suffix == '.feather':
+        df = pd.read_feather(path, columns=columns)
+    else:
+        header = columns if columns is not None else columns_of(path)
+        df = pd.read_csv(path, usecols=columns, parse_dates=[c for c in DATES if c in header], low_memory=False)
+    return apply_schema(df)
+
+
+def write_table(df, name, fmt='.parquet'):
+    """Write `df` with the canonical types as <name><fmt>; returns the path."""
+    path = artifact_path(name, fmt)
+    df = apply_schema(df.copy())
+    if path.suffix == '.parquet':
+        df.to_parquet(path, index=False)
+    elif path.suffix == '.feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+    return path
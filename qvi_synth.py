@@ -0,0 +1,213 @@
+# Synthetic QVI-shaped transaction and customer data (seeded, 100k to 100M lines)
+
+# qvi_synth.py
+# Run: python qvi_synth.py 1M synth/              # -> synth/QVI_transaction_data.csv + QVI_purchase_behaviour.csv
+#      python qvi_synth.py 264836 . --xlsx         # workbook (sheet 'in') like the real extract
+# Used by benchmark.py:
+#   tx_path, cust_path = write_dataset(out_dir, n_lines=1_000_000, seed=0)
+#
+# Same columns and encodings as the real files (Excel serial DATE, STORE_NBR,
+# LYLTY_CARD_NBR, TXN_ID, PROD_NBR, PROD_NAME, PROD_QTY, TOT_SALES; loyalty card
+# lifestage / premium segment). The skews follow the real extract: ~272 stores
+# with a tail of very small ones, ~3.6 lines per loyalty card with a long tail,
+# the 114 real product descriptions (chips plus salsas and other snacks) at
+# mildly uneven popularity, ~1.007 lines per basket, mostly 2 packs per line
+# with rare bulk outliers, and one year of days (no Christmas Day) with a
+# weekly cycle and a December peak. Store and card counts grow with size.
+# Stores are generated in blocks, each from its own seeded stream, and written
+# incrementally, so memory is bounded by the block size and not the total.
+import argparse
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+SYNTH_VERSION = 1             # bump when the generated distributions change
+REAL_LINES = 264_836
+REAL_STORES = 272
+LINES_PER_CARD = 3.65
+START, END = pd.Timestamp('2018-07-01'), pd.Timestamp('2019-06-30')
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+XLSX_MAX_ROWS = 1_048_575
+BLOCK_LINES = 2_000_000       # approximate lines generated per block of stores
+
+LINES_PER_BASKET = ([1, 2, 3], [0.9935, 0.006, 0.0005])
+PACKS_PER_LINE = ([1, 2, 3, 4, 5], [0.0905, 0.8925, 0.0065, 0.0055, 0.005])
+BULK_QTY, BULK_RATE = 200, 1e-5
+LIFESTAGES = (['OLDER SINGLES/COUPLES', 'RETIREES', 'OLDER FAMILIES', 'YOUNG FAMILIES',
+               'YOUNG SINGLES/COUPLES', 'MIDAGE SINGLES/COUPLES', 'NEW FAMILIES'],
+              [0.206, 0.204, 0.134, 0.125, 0.197, 0.099, 0.035])
+PREMIUM = (['Mainstream', 'Budget', 'Premium'], [0.40, 0.34, 0.26])
+
+PRODUCTS = [
+    'Natural Chip        Compny SeaSalt175g', 'CCs Nacho Cheese    175g', 'Smiths Crinkle Cut  Chips Chicken 170g',
+    'Smiths Chip Thinly  S/Cream&Onion 175g', 'Kettle Tortilla ChpsHny&Jlpno Chili 150g',
+    'Old El Paso Salsa   Dip Tomato Mild 300g', 'Smiths Crinkle Chips Salt & Vinegar 330g',
+    'Grain Waves         Sweet Chilli 210g', 'Doritos Corn Chip Mexican Jalapeno 150g',
+    'Grain Waves Sour    Cream&Chives 210G', 'Kettle Sensations   Siracha Lime 150g', 'Twisties Cheese     270g',
+    'WW Crinkle Cut      Chicken 175g', 'Thins Chips Light&  Tangy 175g', 'CCs Original 175g', 'Burger Rings 220g',
+    'NCC Sour Cream &    Garden Chives 175g', 'Doritos Corn Chip Southern Chicken 150g', 'Cheezels Cheese Box 125g',
+    'Smiths Crinkle      Original 330g', 'Infzns Crn Crnchers Tangy Gcamole 110g', 'Kettle Sea Salt     And Vinegar 175g',
+    'Smiths Chip Thinly  Cut Original 175g', 'Kettle Original 175g', 'Red Rock Deli Thai  Chilli&Lime 150g',
+    'Pringles Sthrn FriedChicken 134g', 'Pringles Sweet&Spcy BBQ 134g', 'Red Rock Deli SR    Salsa & Mzzrlla 150g',
+    'Thins Chips         Originl saltd 175g', 'Red Rock Deli Sp    Salt & Truffle 150G',
+    'Smiths Thinly       Swt Chli&S/Cream175G', 'Kettle Chilli 175g', 'Doritos Mexicana    170g',
+    'Smiths Crinkle Cut  French OnionDip 150g', 'Natural ChipCo      Hony Soy Chckn175g', 'Dorito Corn Chp     Supreme 380g',
+    'Twisties Chicken270g', 'Smiths Thinly Cut   Roast Chicken 175g', 'Smiths Crinkle Cut  Tomato Salsa 150g',
+    'Kettle Mozzarella   Basil & Pesto 175g', 'Infuzions Thai SweetChili PotatoMix 110g',
+    'Kettle Sensations   Camembert & Fig 150g', 'Smith Crinkle Cut   Mac N Cheese 150g', 'Kettle Honey Soy    Chicken 175g',
+    'Thins Chips Seasonedchicken 175g', 'Smiths Crinkle Cut  Salt & Vinegar 170g', 'Infuzions BBQ Rib   Prawn Crackers 110g',
+    'GrnWves Plus Btroot & Chilli Jam 180g', 'Tyrrells Crisps     Lightly Salted 165g',
+    'Kettle Sweet Chilli And Sour Cream 175g', 'Doritos Salsa       Medium 300g', 'Kettle 135g Swt Pot Sea Salt',
+    'Pringles SourCream  Onion 134g', 'Doritos Corn Chips  Original 170g', 'Twisties Cheese     Burger 250g',
+    'Old El Paso Salsa   Dip Chnky Tom Ht300g', 'Cobs Popd Swt/Chlli &Sr/Cream Chips 110g', 'Woolworths Mild     Salsa 300g',
+    'Natural Chip Co     Tmato Hrb&Spce 175g', 'Smiths Crinkle Cut  Chips Original 170g', 'Cobs Popd Sea Salt  Chips 110g',
+    'Smiths Crinkle Cut  Chips Chs&Onion170g', 'French Fries Potato Chips 175g', 'Old El Paso Salsa   Dip Tomato Med 300g',
+    'Doritos Corn Chips  Cheese Supreme 170g', 'Pringles Original   Crisps 134g', 'RRD Chilli&         Coconut 150g',
+    'WW Original Corn    Chips 200g', 'Thins Potato Chips  Hot & Spicy 175g', 'Cobs Popd Sour Crm  &Chives Chips 110g',
+    'Smiths Crnkle Chip  Orgnl Big Bag 380g', 'Doritos Corn Chips  Nacho Cheese 170g', 'Kettle Sensations   BBQ&Maple 150g',
+    'WW D/Style Chip     Sea Salt 200g', 'Pringles Chicken    Salt Crips 134g', 'WW Original Stacked Chips 160g',
+    'Smiths Chip Thinly  CutSalt/Vinegr175g', 'Cheezels Cheese 330g', 'Tostitos Lightly    Salted 175g',
+    'Thins Chips Salt &  Vinegar 175g', 'Smiths Crinkle Cut  Chips Barbecue 170g', 'Cheetos Puffs 165g',
+    'RRD Sweet Chilli &  Sour Cream 165g', 'WW Crinkle Cut      Original 175g', 'Tostitos Splash Of  Lime 175g',
+    'Woolworths Medium   Salsa 300g', 'Kettle Tortilla ChpsBtroot&Ricotta 150g', 'CCs Tasty Cheese    175g',
+    'Woolworths Cheese   Rings 190g', 'Tostitos Smoked     Chipotle 175g', 'Pringles Barbeque   134g',
+    'WW Supreme Cheese   Corn Chips 200g', 'Pringles Mystery    Flavour 134g', 'Tyrrells Crisps     Ched & Chives 165g',
+    'Snbts Whlgrn Crisps Cheddr&Mstrd 90g', 'Cheetos Chs & Bacon Balls 190g', 'Pringles Slt Vingar 134g',
+    'Infuzions SourCream&Herbs Veg Strws 110g', 'Kettle Tortilla ChpsFeta&Garlic 150g',
+    'Infuzions Mango     Chutny Papadums 70g', 'RRD Steak &         Chimuchurri 150g', 'RRD Honey Soy       Chicken 165g',
+    'Sunbites Whlegrn    Crisps Frch/Onin 90g', 'RRD Salt & Vinegar  165g', 'Doritos Cheese      Supreme 330g',
+    'Smiths Crinkle Cut  Snag&Sauce 150g', 'WW Sour Cream &OnionStacked Chips 160g', 'RRD Lime & Pepper   165g',
+    'Natural ChipCo Sea  Salt & Vinegr 175g', 'Red Rock Deli Chikn&Garlic Aioli 150g', 'RRD SR Slow Rst     Pork Belly 150g',
+    'RRD Pc Sea Salt     165g', 'Smith Crinkle Cut   Bolognese 150g', 'Doritos Salsa Mild  300g',
+]
+
+
+def parse_size(s):
+    """'100k' / '1M' / '2.5M' / '264836' -> number of lines."""
+    m = re.fullmatch(r'([\d.]+)\s*([kKmM]?)', str(s).strip())
+    if not m:
+        raise ValueError(f'bad size {s!r}')
+    return int(float(m.group(1)) * {'': 1, 'k': 1e3, 'm': 1e6}[m.group(2).lower()])
+
+
+def catalogue():
+    """Product number, description, unit price and popularity weight (fixed, independent of the data seed)."""
+    rng = np.random.default_rng(114)
+    grams = np.array([int(re.search(r'(\d+)[gG]', p).group(1)) for p in PRODUCTS])
+    price = np.round(1.2 + 0.0135 * grams * rng.uniform(0.8, 1.4, len(grams)), 1)
+    weight = rng.uniform(1.0, 2.25, len(grams))        # top seller ~2x the slowest, as in the real data
+    return pd.DataFrame({'PROD_NBR': np.arange(1, len(PRODUCTS) + 1), 'PROD_NAME': PRODUCTS,
+                         'unit_price': price, 'weight': weight / weight.sum()})
+
+
+def calendar():
+    """Trading days with their relative volume: weekly cycle, December ramp, no Christmas Day."""
+    days = pd.date_range(START, END, freq='D')
+    days = days[~((days.month == 12) & (days.day == 25))]
+    w = 1 + 0.04 * np.isin(days.dayofweek, [4, 5, 6])
+    w = w * (1 + 0.25 * ((days.month == 12) & (days.day >= 18) & (days.day <= 24)))
+    return days, w / w.sum()
+
+
+def store_sizes(n_lines, rng):
+    """Lines per store: most stores similar, ~10% tiny stores (as in the real extract)."""
+    n_stores = max(REAL_STORES, int(round(REAL_STORES * np.sqrt(n_lines / REAL_LINES))))
+    w = rng.gamma(6.0, 1 / 6.0, n_stores)
+    tiny = rng.random(n_stores) < 0.1
+    w[tiny] *= rng.uniform(0.002, 0.05, tiny.sum())
+    return rng.multinomial(n_lines, w / w.sum())
+
+
+def _store_block(stores, sizes, rng, products, days, day_w, card_digits, txn_offset):
+    """Transactions and customers for a block of stores (numbers `stores`, line counts `sizes`)."""
+    tx_parts, cust_parts = [], []
+    for store, n in zip(stores, sizes):
+        if n == 0:
+            continue
+        # baskets: 1-3 lines each, adding up to n lines
+        k = rng.choice(LINES_PER_BASKET[0], size=n, p=LINES_PER_BASKET[1])
+        k = k[:np.searchsorted(np.cumsum(k), n) + 1]
+        k[-1] -= k.sum() - n
+        n_tx = len(k)
+        # loyalty cards of this store, long-tailed activity
+        n_cards = max(1, int(round(1.1 * n / LINES_PER_CARD)))   # ~10% of drawn cards end up unused
+        card_w = rng.lognormal(0.0, 0.4, n_cards)
+        card = rng.choice(n_cards, size=n_tx, p=card_w / card_w.sum())
+        day = rng.choice(len(days), size=n_tx, p=day_w)
+        order = np.lexsort((day, card))                 # the extract is ordered by store, card
+        card, day = card[order], day[order]
+        txn = txn_offset + np.arange(1, n_tx + 1)
+        txn_offset += n_tx
+
+        line_tx = np.repeat(np.arange(n_tx), k)
+        prod = rng.choice(len(products), size=n, p=products['weight'].to_numpy())
+        qty = rng.choice(PACKS_PER_LINE[0], size=n, p=PACKS_PER_LINE[1])
+        qty[rng.random(n) < BULK_RATE] = BULK_QTY
+        card_nbr = store * 10**card_digits + card
+        tx_parts.append(pd.DataFrame({
+            'DATE': (days[day[line_tx]] - EXCEL_EPOCH).days,
+            'STORE_NBR': store,
+            'LYLTY_CARD_NBR': card_nbr[line_tx],
+            'TXN_ID': txn[line_tx],
+            'PROD_NBR': products['PROD_NBR'].to_numpy()[prod],
+            'PROD_NAME': products['PROD_NAME'].to_numpy()[prod],
+            'PROD_QTY': qty,
+            'TOT_SALES': np.round(qty * products['unit_price'].to_numpy()[prod], 2)
+        }))
+        used = np.unique(card)
+        cust_parts.append(pd.DataFrame({
+            'LYLTY_CARD_NBR': store * 10**card_digits + used,
+            'LIFESTAGE': rng.choice(LIFESTAGES[0], size=len(used), p=np.divide(LIFESTAGES[1], sum(LIFESTAGES[1]))),
+            'PREMIUM_CUSTOMER': rng.choice(PREMIUM[0], size=len(used), p=PREMIUM[1])
+        }))
+    return pd.concat(tx_parts, ignore_index=True), pd.concat(cust_parts, ignore_index=True), txn_offset
+
+
+def generate(n_lines, seed=0, block_lines=BLOCK_LINES):
+    """Yield (transactions, customers) blocks of a dataset of about `n_lines` lines."""
+    rng = np.random.default_rng([seed, 0])
+    sizes = store_sizes(n_lines, rng)
+    stores = np.arange(1, len(sizes) + 1)
+    products = catalogue()
+    days, day_w = calendar()
+    card_digits = max(3, len(str(int(round(sizes.max() / LINES_PER_CARD)))))   # store 12 -> cards 12000..
+    bounds = np.searchsorted(np.cumsum(sizes), np.arange(block_lines, sizes.sum(), block_lines))
+    txn_offset = 0
+    for b, (lo, hi) in enumerate(zip(np.r_[0, bounds + 1], np.r_[bounds + 1, len(sizes)])):
+        if lo >= hi:
+            continue
+        tx, cust, txn_offset = _store_block(stores[lo:hi], sizes[lo:hi], np.random.default_rng([seed, b + 1]),
+                                            products, days, day_w, card_digits, txn_offset)
+        yield tx, cust
+
+
+def write_dataset(out_dir, n_lines, seed=0, xlsx=False, block_lines=BLOCK_LINES):
+    """Write QVI_transaction_data.(csv|xlsx) and QVI_purchase_behaviour.csv; returns both paths."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tx_path = out_dir / ('QVI_transaction_data.xlsx' if xlsx else 'QVI_transaction_data.csv')
+    cust_path = out_dir / 'QVI_purchase_behaviour.csv'
+    if xlsx:
+        if n_lines > XLSX_MAX_ROWS:
+            raise ValueError(f'{n_lines} lines do not fit in one worksheet; write CSV instead')
+        blocks = list(generate(n_lines, seed, block_lines))
+        tx = pd.concat([t for t, _ in blocks], ignore_index=True)
+        tx.to_excel(tx_path, sheet_name='in', index=False)
+        pd.concat([c for _, c in blocks], ignore_index=True).to_csv(cust_path, index=False)
+        return tx_path, cust_path
+    for i, (tx, cust) in enumerate(generate(n_lines, seed, block_lines)):
+        tx.to_csv(tx_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        cust.to_csv(cust_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return tx_path, cust_path
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Write a synthetic QVI-shaped dataset.')
+    ap.add_argument('size', help="number of transaction lines, e.g. 100k, 1M, 100M")
+    ap.add_argument('out_dir', nargs='?', default='.')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--xlsx', action='store_true', help="write the transactions as a workbook (sheet 'in'), up to ~1M lines")
+    args = ap.parse_args()
+    for p in write_dataset(args.out_dir, parse_size(args.size), args.seed, args.xlsx):
+        print('wrote', p)
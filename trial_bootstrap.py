@@ -0,0 +1,53 @@
+# Batched, vectorized bootstrap of a mean (i.i.d. days or moving blocks)
+
+# trial_bootstrap.py
+# Used by 011_trial_analysis.py:
+#   boot = bootstrap_means(diff_values, nboot=2000, rng=np.random.default_rng(seed))
+#   ci_low, ci_high = np.percentile(boot, [2.5, 97.5])
+#
+# Resample indices are drawn as a (batch x n) matrix and reduced with NumPy;
+# batches are sized so the index matrix stays under `max_batch_bytes`.
+import numpy as np
+
+MAX_BATCH_BYTES = 64 * 2**20
+
+
+def _batch_rows(n, max_batch_bytes):
+    return max(1, max_batch_bytes // (8 * max(n, 1)))
+
+
+def bootstrap_means(values, nboot=2000, rng=None, block_size=None, max_batch_bytes=MAX_BATCH_BYTES):
+    """Means of `nboot` resamples of `values`.
+
+    block_size=None resamples single observations (same draws as calling
+    rng.choice(values, len(values)) nboot times). With block_size=L it is a
+    moving-block bootstrap: ceil(n/L) blocks of L consecutive observations,
+    which keeps e.g. weekly seasonality (L=7) of daily series inside a resample.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if rng is None:
+        rng = np.random.default_rng()
+    if n == 0:
+        return np.full(nboot, np.nan)
+    if block_size is not None:
+        block_size = min(block_size, n)
+        n_blocks = -(-n // block_size)
+        offsets = np.arange(block_size)
+    out = np.empty(nboot)
+    step = _batch_rows(n, max_batch_bytes)
+    for start in range(0, nboot, step):
+        b = min(step, nboot - start)
+        if block_size is None:
+            idx = rng.integers(0, n, size=(b, n))
+        else:
+            starts = rng.integers(0, n - block_size + 1, size=(b, n_blocks))
+            idx = (starts[:, :, None] + offsets).reshape(b, -1)[:, :n]
+        out[start:start + b] = values[idx].mean(axis=1)
+    return out
+
+
+def bootstrap_ci(values, nboot=2000, alpha=0.05, rng=None, block_size=None, max_batch_bytes=MAX_BATCH_BYTES):
+    """Percentile confidence interval (low, high) for the mean of `values`."""
+    boot = bootstrap_means(values, nboot, rng, block_size, max_batch_bytes)
+    return np.percentile(boot, 100 * alpha / 2), np.percentile(boot, 100 * (1 - alpha / 2))
@@ -0,0 +1,115 @@
+# Control-store matching on full pre-period series (correlation + magnitude distance)
+
+# trial_matching.py
+# Used by 011_trial_analysis.py:
+#   sim = StoreSimilarity.build(daily, pre_start, trial_start, exclude=TRIAL_STORES)
+#   ctrls = sim.controls(101, N_CONTROLS)
+#
+# Quantium-style metric: for each metric series (revenue, customers) over the
+# pre-period, score = CORR_WEIGHT * Pearson correlation + (1 - CORR_WEIGHT) *
+# normalized magnitude similarity, averaged over metrics. Magnitude similarity
+# of store i to candidate j in period t is 1 - (|x_it - x_jt| - min_j) / (max_j - min_j),
+# averaged over periods. Everything is computed for all pairs at once from a
+# dense store x period matrix; trial stores are never candidates. The score and
+# ranking matrices are cached per pre-period window and data digest, and the
+# ranking makes each top-N control query a row lookup.
+import hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = Path('.cache')
+CORR_WEIGHT = 0.5
+METRICS = ['daily_revenue', 'daily_customers']
+
+
+def period_matrix(daily, value_col, pre_start, trial_start, freq='W'):
+    """Dense store x period matrix of `value_col` over [pre_start, trial_start); missing days count as 0."""
+    pre = daily[(daily['date'] >= pre_start) & (daily['date'] < trial_start)]
+    s_codes, stores = pd.factorize(pre['store_id'], sort=True)
+    days = (pre['date'] - pre_start).dt.days.to_numpy()
+    n_days = (trial_start - pre_start).days
+    step = 7 if freq == 'W' else 1
+    t_codes = days // step
+    M = np.zeros((len(stores), -(-n_days // step)))
+    np.add.at(M, (s_codes, t_codes), pre[value_col].to_numpy(float))
+    return M, np.asarray(stores)
+
+
+def pairwise_correlation(M, cols):
+    """Pearson correlation of every row of M with rows `cols` (constant series -> 0)."""
+    Z = M - M.mean(axis=1, keepdims=True)
+    norm = np.sqrt((Z**2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        C = (Z @ Z[cols].T) / np.outer(norm, norm[cols])
+    return np.nan_to_num(C)
+
+
+def pairwise_magnitude(M, cols, block=256):
+    """Mean over periods of the min/max-normalized magnitude similarity, for all rows vs rows `cols`."""
+    S = np.empty((len(M), len(cols)))
+    cand = M[cols]
+    for start in range(0, len(M), block):
+        D = np.abs(M[start:start + block, None, :] - cand[None, :, :])   # rows x candidates x periods
+        own = np.arange(start, min(start + block, len(M)))[:, None] == cols[None, :]
+        # a store is not its own candidate: left out of the min/max, its score is NaN
+        lo = np.where(own[:, :, None], np.inf, D).min(axis=1, keepdims=True)
+        span = np.where(own[:, :, None], -np.inf, D).max(axis=1, keepdims=True) - lo
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mag = np.where(span > 0, 1 - (D - lo) / span, 1.0)
+        S[start:start + block] = np.where(own, np.nan, mag.mean(axis=2))
+    return S
+
+
+class StoreSimilarity:
+    """All-pairs similarity of stores to candidate control stores for one pre-period window."""
+
+    def __init__(self, stores, candidates, score, corr, magnitude):
+        self.stores = stores
+        self.candidates = candidates
+        self.score = score              # stores x candidates
+        self.corr = corr
+        self.magnitude = magnitude
+        self.row = {s: i for i, s in enumerate(stores)}
+        # candidates ordered best-first for every store; self sorts last
+        masked = np.where(stores[:, None] == candidates[None, :], -np.inf, score)
+        self.ranking = np.argsort(-masked, axis=1, kind='stable')
+
+    def _row(self, store):
+        if store not in self.row:
+            raise ValueError(f'store {store!r} has no rows in the pre-period, so it has no control ranking')
+        return self.row[store]
+
+    def controls(self, store, n):
+        """Top-n control store ids for `store` (a row lookup in the precomputed ranking)."""
+        top = self.ranking[self._row(store), :n]
+        return [c for c in self.candidates[top].tolist() if c != store][:n]
+
+    def control_scores(self, store, n):
+        i = self._row(store)
+        return self.score[i, self.ranking[i, :n]].tolist()
+
+    @classmethod
+    def build(cls, daily, pre_start, trial_start, exclude=(), freq='W', metrics=METRICS, cache_dir=CACHE_DIR):
+        metrics = [m for m in metrics if m in daily.columns]
+        mats = [period_matrix(daily, m, pre_start, trial_start, freq) for m in metrics]
+        stores = mats[0][1]
+        cand_cols = np.flatnonzero(~np.isin(stores, list(exclude)))
+
+        h = hashlib.sha256(repr((str(pre_start), str(trial_start), freq, metrics, CORR_WEIGHT)).encode())
+        h.update(stores.astype(str).tobytes())
+        h.update(cand_cols.tobytes())
+        for M, _ in mats:
+            h.update(np.ascontiguousarray(M).tobytes())
+        cache = Path(cache_dir) / f'similarity-{h.hexdigest()[:16]}.npz' if cache_dir else None
+        if cache is not None and cache.exists():
+            z = np.load(cache)
+            return cls(stores, stores[cand_cols], z['score'], z['corr'], z['magnitude'])
+
+        corr = np.mean([pairwise_correlation(M, cand_cols) for M, _ in mats], axis=0)
+        magnitude = np.mean([pairwise_magnitude(M, cand_cols) for M, _ in mats], axis=0)
+        score = CORR_WEIGHT * corr + (1 - CORR_WEIGHT) * magnitude
+        if cache is not None:
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(cache, score=score, corr=corr, magnitude=magnitude)
+        return cls(stores, stores[cand_cols], score, corr, magnitude)
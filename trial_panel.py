@@ -0,0 +1,159 @@
+# Dense store x day panel with prefix sums: O(1) windows and vectorized trial-window sweeps
+
+# trial_panel.py
+# Used by 011_trial_analysis.py:
+#   panel = StorePanel.from_daily(daily)
+#   df = panel.long_frame([trial] + ctrls, pre_start, TRIAL_END)       # replaces boolean masks over daily
+#   sweep = panel.window_sweep(matches, starts=pd.date_range(...), lengths=[28, 56], pre_days=56)
+#
+# Every metric is one contiguous store x calendar-day float array (NaN where a
+# store has no row that day), so any date window is a column slice. Window sums
+# and day counts come from cumulative sums along the day axis: the total over
+# [lo, hi) is prefix[:, hi] - prefix[:, lo] for all stores at once. The sweep
+# evaluates pre/post means of each store and its pooled controls, the DiD
+# uplift and pre-period matching features for every (store, start, length)
+# combination with array indexing, without re-filtering a DataFrame.
+import numpy as np
+import pandas as pd
+
+
+def _prefix(a):
+    # cumulative sum along days with a leading zero column: window [lo, hi) = p[:, hi] - p[:, lo]
+    p = np.zeros((a.shape[0], a.shape[1] + 1))
+    np.cumsum(a, axis=1, out=p[:, 1:])
+    return p
+
+
+class StorePanel:
+    """Store x calendar-day arrays of the daily metrics, with cached prefix sums."""
+
+    def __init__(self, stores, dates, values, dtypes=None):
+        self.stores = np.asarray(stores)
+        self.dates = pd.DatetimeIndex(dates)   # contiguous days
+        self.values = values                   # metric -> (stores, days) float array
+        self.dtypes = dtypes or {}
+        self.row = pd.Series(np.arange(len(self.stores)), index=self.stores)
+        self._prefix = {}
+
+    @classmethod
+    def from_daily(cls, daily, metrics=None):
+        """Panel of a store-daily frame (store_id, date, metric columns)."""
+        metrics = metrics or [c for c in daily.columns if c not in ('store_id', 'date')]
+        s_codes, stores = pd.factorize(daily['store_id'], sort=True)
+        first = daily['date'].min()
+        d_codes = (daily['date'] - first).dt.days.to_numpy()
+        dates = pd.date_range(first, periods=d_codes.max() + 1, freq='D')
+        values = {}
+        for m in metrics:
+            a = np.full((len(stores), len(dates)), np.nan)
+            a[s_codes, d_codes] = daily[m].to_numpy(float)
+            values[m] = a
+        return cls(np.asarray(stores), dates, values, {m: daily[m].dtype for m in metrics})
+
+    def day(self, date):
+        """Day index of `date` (scalar or array-like) on the panel's calendar."""
+        if np.ndim(date) == 0:
+            return (pd.Timestamp(date) - self.dates[0]).days
+        return np.asarray((pd.DatetimeIndex(date) - self.dates[0]).days)
+
+    def prefix(self, metric):
+        """(sums, counts) prefix arrays of `metric` over days; computed once per metric."""
+        if metric not in self._prefix:
+            a = self.values[metric]
+            present = ~np.isnan(a)
+            self._prefix[metric] = (_prefix(np.where(present, a, 0.0)), _prefix(present.astype(float)))
+        return self._prefix[metric]
+
+    def window_mean(self, metric, start, end, rows=None):
+        """Mean over the days a store has a row in [start, end] (dates, inclusive); NaN if none."""
+        lo, hi = max(self.day(start), 0), min(self.day(end) + 1, len(self.dates))
+        sums, counts = self.prefix(metric)
+        rows = slice(None) if rows is None else rows
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (sums[rows, hi] - sums[rows, lo]) / (counts[rows, hi] - counts[rows, lo])
+
+    def long_frame(self, stores, start, end, metrics=None):
+        """Store-daily rows of `stores` over [start, end] (dates, inclusive), in store then date order."""
+        metrics = metrics or list(self.values)
+        rows = np.sort(self.row.loc[list(stores)].to_numpy())
+        lo, hi = max(self.day(start), 0), min(self.day(end) + 1, len(self.dates))
+        present = ~np.isnan(self.values[metrics[0]][rows, lo:hi])
+        r, d = np.nonzero(present)
+        out = pd.DataFrame({'store_id': self.stores[rows[r]], 'date': self.dates[lo + d]})
+        for m in metrics:
+            col = self.values[m][rows[r], lo + d]
+            out[m] = col.astype(self.dtypes[m]) if m in self.dtypes else col
+        return out
+
+    def window_sweep(self, matches, starts, lengths, pre_days, metric='daily_revenue'):
+        """Pre/post means, DiD uplift and matching features for every (store, start, length).
+
+        `matches` maps store id -> control store ids (pooled, as in 011). The post
+        window is [start, start + length) and the pre window the `pre_days` before
+        start; windows running off the panel give NaN. Matching features are
+        computed over the pre window: Pearson correlation of the store with the
+        daily mean of its controls (days where both have data), and the ratio of
+        their pre-period means. Returns one row per combination.
+        """
+        stores = [s for s in matches if s in self.row.index]
+        rows = self.row.loc[stores].to_numpy()
+        x = self.values[metric][rows]
+        # pooled controls: per-day sum and number of control stores with a row
+        c_sum = np.zeros_like(x)
+        c_cnt = np.zeros_like(x)
+        for i, s in enumerate(stores):
+            ctrl = self.values[metric][self.row.loc[list(matches[s])].to_numpy()]
+            c_sum[i] = np.nansum(ctrl, axis=0)
+            c_cnt[i] = (~np.isnan(ctrl)).sum(axis=0)
+        x_ok = ~np.isnan(x)
+        x0 = np.where(x_ok, x, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            y = np.where(c_cnt > 0, c_sum / c_cnt, 0.0)    # daily mean of the controls
+        both = (x_ok & (c_cnt > 0)).astype(float)
+        P = {k: _prefix(v) for k, v in {
+            'xs': x0, 'xn': x_ok.astype(float), 'cs': c_sum, 'cn': c_cnt,
+            'w': both, 'wx': both * x0, 'wy': both * y, 'wxx': both * x0 * x0,
+            'wyy': both * y * y, 'wxy': both * x0 * y}.items()}
+
+        n_days = len(self.dates)
+        s = self.day(pd.DatetimeIndex(starts))
+        L = np.asarray(lengths)
+        pre_lo, post_hi = s - pre_days, s[:, None] + L[None, :]
+        pre_ok = (pre_lo >= 0) & (s <= n_days)
+        post_ok = pre_ok[:, None] & (post_hi <= n_days)
+        s_c = np.clip(s, 0, n_days)
+        pre_c = np.clip(pre_lo, 0, n_days)
+        post_c = np.clip(post_hi, 0, n_days)
+
+        def pre(k):
+            return P[k][:, s_c] - P[k][:, pre_c]         # stores x starts
+
+        def post(k):
+            return P[k][:, post_c] - P[k][:, s_c][:, :, None]   # stores x starts x lengths
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pre_trial = np.where(pre_ok, pre('xs') / pre('xn'), np.nan)
+            pre_ctrl = np.where(pre_ok, pre('cs') / pre('cn'), np.nan)
+            post_trial = np.where(post_ok, post('xs') / post('xn'), np.nan)
+            post_ctrl = np.where(post_ok, post('cs') / post('cn'), np.nan)
+            n, sx, sy = pre('w'), pre('wx'), pre('wy')
+            cov = pre('wxy') - sx * sy / n
+            corr = cov / np.sqrt((pre('wxx') - sx**2 / n) * (pre('wyy') - sy**2 / n))
+            corr = np.where(pre_ok, corr, np.nan)
+            ratio = pre_trial / pre_ctrl
+        uplift = (post_trial - pre_trial[:, :, None]) - (post_ctrl - pre_ctrl[:, :, None])
+
+        shape = uplift.shape
+        i, j, k = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing='ij')
+        return pd.DataFrame({
+            'store_id': np.asarray(stores)[i.ravel()],
+            'start': pd.DatetimeIndex(starts)[j.ravel()],
+            'length': L[k.ravel()],
+            'pre_trial': pre_trial[i, j].ravel(),
+            'post_trial': post_trial.ravel(),
+            'pre_ctrl': pre_ctrl[i, j].ravel(),
+            'post_ctrl': post_ctrl.ravel(),
+            'uplift': uplift.ravel(),
+            'pre_corr': corr[i, j].ravel(),
+            'pre_ratio': ratio[i, j].ravel()
+        })
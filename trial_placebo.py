@@ -0,0 +1,96 @@
+# Placebo / permutation inference: every non-trial store as a pseudo-trial
+
+# trial_placebo.py
+# Used by 011_trial_analysis.py (PLACEBO = True):
+#   matches = {s: sim.controls(s, N_CONTROLS) for s in sim.stores if s not in TRIAL_STORES}
+#   null = placebo_null(daily, matches, pre_start, TRIAL_START, TRIAL_END)
+#   res_df = res_df.join(placebo_pvalues(null, res_df.set_index('trial_store')['did_coef']), on='trial_store')
+#
+# Each pseudo-trial uses its own matched controls (trial_matching, real trial
+# stores excluded from the pool) and the same DiD fit (trial_did.did_hc1).
+# Work is split over a process pool; the
+# dense store x day revenue panel is written once to a .npy file and every
+# worker memory-maps it read-only instead of receiving a pickled DataFrame.
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from trial_did import did_hc1
+
+_PANEL = None  # per-worker read-only memmap of the store x day panel
+
+
+def dense_panel(daily, value_col='daily_revenue'):
+    """Store x day float array (NaN where a store has no row) plus store ids and dates."""
+    s_codes, stores = pd.factorize(daily['store_id'], sort=True)
+    d_codes, dates = pd.factorize(daily['date'], sort=True)
+    values = np.full((len(stores), len(dates)), np.nan)
+    values[s_codes, d_codes] = daily[value_col].to_numpy(float)
+    return values, np.asarray(stores), pd.DatetimeIndex(dates)
+
+
+def _attach(path):
+    global _PANEL
+    _PANEL = np.load(path, mmap_mode='r')
+
+
+def _placebo_chunk(pseudo, lo, post_lo, hi):
+    """DiD of each pseudo-trial against its controls; `pseudo` holds panel row arrays [trial, *controls]."""
+    parts = []
+    days = np.arange(lo, hi)
+    for rows in pseudo:
+        i = rows[0]
+        block = np.asarray(_PANEL[rows, lo:hi])
+        r, d = np.nonzero(~np.isnan(block))
+        parts.append(pd.DataFrame({
+            'panel': i,
+            'store_id': rows[r],
+            'is_trial': (r == 0).astype(int),
+            'post': (days[d] >= post_lo).astype(int),
+            'daily_revenue': block[r, d]
+        }))
+    return did_hc1(pd.concat(parts, ignore_index=True))
+
+
+def placebo_null(daily, matches, pre_start, trial_start, trial_end, n_workers=None, chunk_size=32):
+    """Placebo DiD estimates for every pseudo-trial store.
+
+    `matches` maps each pseudo-trial store id to its list of control store
+    ids. Returns one row per pseudo-trial store.
+    """
+    values, stores, dates = dense_panel(daily)
+    store_row = pd.Series(np.arange(len(stores)), index=stores)
+    pseudo = [store_row.loc[[s] + list(c)].to_numpy() for s, c in matches.items() if s in store_row.index]
+
+    lo = dates.searchsorted(pre_start)
+    post_lo = dates.searchsorted(trial_start)
+    hi = dates.searchsorted(trial_end, side='right')
+    chunks = [pseudo[i:i + chunk_size] for i in range(0, len(pseudo), chunk_size)]
+    args = (lo, post_lo, hi)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'panel.npy')
+        np.save(path, values)
+        del values
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_attach, initargs=(path,)) as ex:
+            futures = [ex.submit(_placebo_chunk, c, *args) for c in chunks]
+            null = pd.concat([f.result() for f in futures])
+    null.index = pd.Index(stores[null.index], name='store_id')
+    return null
+
+
+def placebo_pvalues(null, trial_coefs):
+    """Two-sided permutation p-value and percentile of each trial uplift in the placebo null."""
+    ref = np.abs(null['did_coef'].dropna().to_numpy())
+    coefs = null['did_coef'].dropna().to_numpy()
+    n = len(ref)
+    rows = []
+    for trial, coef in trial_coefs.items():
+        rows.append({
+            'trial_store': trial,
+            'placebo_pval': (1 + np.sum(ref >= abs(coef))) / (1 + n),
+            'placebo_pctile': 100 * np.mean(coefs <= coef),
+            'placebo_n': n
+        })
+    return pd.DataFrame(rows).set_index('trial_store')